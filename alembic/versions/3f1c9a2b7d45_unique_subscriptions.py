@@ -0,0 +1,30 @@
+"""unique subscriptions
+
+Revision ID: 3f1c9a2b7d45
+Revises: 572740b7511b
+Create Date: 2026-10-19 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a2b7d45'
+down_revision = '572740b7511b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # concurrent /start could create duplicated subscriptions, keep the oldest one
+    op.execute(
+        "DELETE FROM conversations c USING conversations d "
+        "WHERE c.conversation = d.conversation AND c.media_source_id = d.media_source_id AND c.id > d.id"
+    )
+    op.create_index('ix_conversations_conversation_media_source_id', 'conversations',
+                    ['conversation', 'media_source_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_conversations_conversation_media_source_id', table_name='conversations')
@@ -2,25 +2,50 @@ import asyncio
 import json
 import sys
 
-from bot.common.crud import get_media_sources, get_conversations_for_media_source
+from bot.common.crud import iter_subscriptions
 from bot.db.database import async_session
 from bot.scrap.reddit_models import SubredditListing
 
 
-async def main():
-    output = {}
+def source_to_key(source: str) -> str:
+    """
+    Reddit listings are stored as urls, any other source is stored as is
+    """
+    provider, source_name = source.split("@", maxsplit=1)
+    if provider == "reddit":
+        return SubredditListing.from_str_tuple(source_name).to_url()
+    return source
+
+
+def key_to_source(key: str) -> str:
+    if key.startswith("http://") or key.startswith("https://"):
+        return "reddit@" + SubredditListing.from_url(key).to_str_tuple()
+    if "@" not in key:
+        raise ValueError(f"Unknown source {key}")
+    return key
+
+
+async def main(output):
+    # subscriptions come ordered by source, so the json object is written source by source
+    current = None
+    sources = 0
+    subscriptions = 0
+    output.write("{")
     async with async_session() as db:
-        sources = await get_media_sources(db)
-        for source in sources:
-            provider, source_name = source.split("@")
-            # todo: non reddit sources?
-            listing = SubredditListing.from_str_tuple(source_name)
-    
-            conversations = await get_conversations_for_media_source(db, source)
-            for conv in conversations:
-                conversation_list = output.setdefault(listing.to_url(), [])
-                conversation_list.append(conv)
-    json.dump(output, sys.stdout, indent=2)
+        async for source, conversation in iter_subscriptions(db):
+            if source != current:
+                output.write("\n  ]," if current else "")
+                output.write(f"\n  {json.dumps(source_to_key(source))}: [\n    ")
+                current = source
+                sources += 1
+            else:
+                output.write(",\n    ")
+            output.write(json.dumps(conversation))
+            subscriptions += 1
+            if subscriptions % 10000 == 0:
+                print(f"Exported {subscriptions} subscriptions", file=sys.stderr)
+    output.write("\n  ]\n}\n" if current else "}\n")
+    print(f"Exported {subscriptions} subscriptions of {sources} sources", file=sys.stderr)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(sys.stdout))
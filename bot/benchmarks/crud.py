@@ -0,0 +1,84 @@
+"""
+Compares column-only read queries with loading full ORM entities.
+Needs a migrated database, benchmark rows are prefixed with "bench@" and removed afterwards.
+
+python -m bot.benchmarks.crud --rows 100000
+"""
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import select, delete
+from sqlalchemy.orm import selectinload
+
+from bot.common.crud import add_subscriptions, get_media_sources, \
+    get_conversations_for_media_source, get_media_sources_for_conversation
+from bot.common.db_models import MediaSource, Conversation
+from bot.db.database import async_session
+
+PREFIX = "bench@"
+
+
+async def orm_media_sources(db):
+    res = await db.execute(select(MediaSource))
+    return [item.media_source for item in res.scalars().all()]
+
+
+async def orm_conversations_for_media_source(db, media_source: str):
+    res = await db.execute(select(MediaSource)
+                           .filter(MediaSource.media_source == media_source)
+                           .options(selectinload(MediaSource.conversation)))
+    return [item.conversation for item in res.scalars().first().conversation]
+
+
+async def orm_media_sources_for_conversation(db, conversation: str):
+    has_conversation = MediaSource.conversation.any(Conversation.conversation == conversation)
+    res = await db.execute(select(MediaSource).filter(has_conversation))
+    return [item.media_source for item in res.scalars().all()]
+
+
+async def measure(name: str, func, repeat: int):
+    async with async_session() as db:
+        await func(db)  # warm up connection and statement caches
+        start = time.perf_counter()
+        for _ in range(repeat):
+            await func(db)
+        elapsed = (time.perf_counter() - start) / repeat
+    print(f"{name:<45} {elapsed * 1000:10.3f} ms")
+
+
+async def main(rows: int, sources: int, repeat: int):
+    source = f"{PREFIX}source_0"
+    conversation = "bench_provider@0"
+    async with async_session() as db:
+        print(f"Populating {rows} subscriptions of {sources} sources")
+        subscriptions = [(f"{PREFIX}source_{i % sources}", f"bench_provider@{i // sources}")
+                         for i in range(rows)]
+        for index in range(0, rows, 5000):
+            await add_subscriptions(db, subscriptions[index:index + 5000])
+        await db.commit()
+
+    try:
+        await measure("get_media_sources (orm)", orm_media_sources, repeat)
+        await measure("get_media_sources", get_media_sources, repeat)
+        await measure("get_conversations_for_media_source (orm)",
+                      lambda db: orm_conversations_for_media_source(db, source), repeat)
+        await measure("get_conversations_for_media_source",
+                      lambda db: get_conversations_for_media_source(db, source), repeat)
+        await measure("get_media_sources_for_conversation (orm)",
+                      lambda db: orm_media_sources_for_conversation(db, conversation), repeat)
+        await measure("get_media_sources_for_conversation",
+                      lambda db: get_media_sources_for_conversation(db, conversation), repeat)
+    finally:
+        async with async_session() as db:
+            await db.execute(delete(MediaSource).where(MediaSource.media_source.startswith(PREFIX)))
+            await db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark subscription read queries")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--sources", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.sources, args.repeat))
@@ -0,0 +1,127 @@
+"""
+Times the scrape-to-Post hot path on the recorded reddit listing and synthetic galleries and videos.
+Results are compared with the committed baseline and the run fails when a case got slower than
+the threshold or the baseline is missing. Timings depend on the machine, store a baseline on the one
+running the comparison.
+
+python -m bot.benchmarks.hot_path --save      # store the baseline on this machine
+python -m bot.benchmarks.hot_path             # compare with it
+"""
+import argparse
+import json
+import os.path
+import sys
+import time
+from typing import Callable, Dict, List
+
+from pydantic import parse_raw_as
+
+from bot.common.models import Post, OutboundMessage
+from bot.scrap.reddit import reddit_post_to_message
+from bot.scrap.reddit_models import RedditReply
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LISTING = os.path.join(ROOT, "wiremock", "reddit", "__files", "pics.json")
+FIXTURES = os.path.join(ROOT, "bot", "tests")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hot_path_baseline.json")
+
+
+def synthetic_listing(fixture: str, count: int) -> str:
+    # the single post of a test fixture repeated as a full listing
+    with open(os.path.join(FIXTURES, fixture)) as f:
+        listing = json.load(f)
+    listing["data"]["children"] = listing["data"]["children"][:1] * count
+    return json.dumps(listing)
+
+
+def to_posts(raw: str) -> List[Post]:
+    reply = parse_raw_as(RedditReply, raw)
+    return [reddit_post_to_message("reddit@pics", item.data) for item in reply.data.children or []]
+
+
+def get_cases() -> Dict[str, Callable]:
+    with open(LISTING) as f:
+        listing = f.read()
+    galleries = synthetic_listing("_post_image_gallery_with_captions.json", 100)
+    videos = synthetic_listing("_post_media_video.json", 100)
+
+    reply = parse_raw_as(RedditReply, listing)
+    posts = to_posts(listing) + to_posts(galleries) + to_posts(videos)
+    conversation_ids = [str(i) for i in range(50)]
+    outbound = [OutboundMessage(conversation_ids=conversation_ids, post=post).json()
+                for post in posts]
+
+    return {
+        "parse listing": lambda: parse_raw_as(RedditReply, listing),
+        "parse galleries": lambda: parse_raw_as(RedditReply, galleries),
+        "parse videos": lambda: parse_raw_as(RedditReply, videos),
+        "reddit_post_to_message": lambda: [reddit_post_to_message("reddit@pics", item.data)
+                                           for item in reply.data.children or []],
+        "galleries to posts": lambda: to_posts(galleries),
+        "videos to posts": lambda: to_posts(videos),
+        "Post.json": lambda: [post.json(exclude_unset=True, exclude_defaults=True,
+                                        exclude_none=True) for post in posts],
+        "OutboundMessage decode": lambda: [parse_raw_as(OutboundMessage, raw) for raw in outbound],
+    }
+
+
+def measure(func: Callable, rounds: int) -> float:
+    """
+    Best of rounds, in seconds. The minimum is the least affected by other load on the machine.
+    """
+    func()  # warm up
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(rounds: int) -> Dict[str, float]:
+    results = {}
+    for name, func in get_cases().items():
+        results[name] = measure(func, rounds)
+        print(f"{name:<30} {results[name] * 1000:10.3f} ms")
+    return results
+
+
+def find_regressions(results: Dict[str, float], baseline: Dict[str, float],
+                     threshold: float) -> List[str]:
+    return [name for name, elapsed in results.items()
+            if name in baseline and elapsed > baseline[name] * (1 + threshold)]
+
+
+def main(rounds: int, baseline_file: str, threshold: float, save: bool) -> int:
+    results = run(rounds)
+    if save:
+        with open(baseline_file, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {baseline_file}")
+        return 0
+
+    if not os.path.exists(baseline_file):
+        # passing without a baseline would hide regressions
+        print(f"No baseline at {baseline_file}, run with --save first", file=sys.stderr)
+        return 1
+
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    for name in results.keys() - baseline.keys():
+        print(f"No baseline for {name}, run with --save to add it", file=sys.stderr)
+    regressions = find_regressions(results, baseline, threshold)
+    for name in regressions:
+        print(f"Regression in {name}: "
+              f"{baseline[name] * 1000:.3f} ms -> {results[name] * 1000:.3f} ms")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark reddit listing to Post conversion")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown, 0.2 is 20%%")
+    parser.add_argument("--save", action="store_true", help="store results as the new baseline")
+    args = parser.parse_args()
+    sys.exit(main(args.rounds, args.baseline, args.threshold, args.save))
@@ -0,0 +1,311 @@
+"""
+Offline load test: the scrapper, the bot and the messenger run in this process against local
+stand-ins for reddit and the Telegram Bot API. Needs postgres, rabbitmq and redis (e.g. from
+docker-compose), nothing is fetched from the internet. Load test listings are prefixed with
+"reddit@loadtest" and removed afterwards.
+
+python -m bot.benchmarks.load --listings 20 --subscribers 50 --post-rate 0.5 --duration 120
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import resource
+import statistics
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from typing import Dict, List, Deque
+
+from aiohttp import web
+from sqlalchemy import delete
+
+from bot.bot import Web2TgBot
+from bot.common.crud import add_subscriptions
+from bot.common.db_models import MediaSource
+from bot.common.redis import get_new_redis
+from bot.common.routing import SubscriptionNotifier
+from bot.common.settings import get_settings
+from bot.db.database import async_session
+from bot.reddit_scrapper import RedditScrapper
+from bot.telegram_messenger import TelegramMessenger
+
+PREFIX = "loadtest"
+TOKEN = "1000:LOADTEST"
+MEDIA_TYPES = ("image", "gallery", "video")
+
+
+class FakeReddit:
+    """
+    Every listing gets new posts at post_rate per second,
+    a listing request returns the newest page of them
+    """
+
+    def __init__(self, base_url: str, post_rate: float, media_weights: List[float], media_size: int,
+                 page: int = 100):
+        self.base_url = base_url
+        self.post_rate = post_rate
+        self.media_weights = media_weights
+        self.media_content = b"\0" * media_size
+        self.page = page
+        self.started = time.time()
+        # post id -> creation time
+        self.created: Dict[str, float] = {}
+        self.requests = 0
+
+    def register(self, app: web.Application):
+        app.router.add_get("/r/{subreddit}/{sorting}/.json", self.listing)
+        app.router.add_get("/media/{name:.*}", self.media)
+
+    async def listing(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        subreddit = request.match_info["subreddit"]
+        count = int((time.time() - self.started) * self.post_rate)
+        children = [{"kind": "t3", "data": self.post(subreddit, index)}
+                    for index in range(count - 1, max(count - self.page, 0) - 1, -1)]
+        return web.json_response({"kind": "Listing",
+                                  "data": {"dist": len(children), "children": children}})
+
+    async def media(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.media_content, content_type="video/mp4")
+
+    def post(self, subreddit: str, index: int) -> dict:
+        post_id = f"{subreddit}_{index}"
+        created = self.started + index / self.post_rate
+        self.created.setdefault(post_id, created)
+        media_type = random.Random(post_id).choices(MEDIA_TYPES, self.media_weights)[0]
+        post = {
+            "subreddit": subreddit, "subreddit_name_prefixed": f"r/{subreddit}",
+            "subreddit_id": "t5_load",
+            "id": post_id, "name": f"t3_{post_id}", "title": f"Post {post_id}", "author": "load",
+            "created": int(created), "created_utc": int(created), "thumbnail": None,
+            "permalink": f"/r/{subreddit}/comments/{post_id}/",
+            "url": f"{self.base_url}/posts/{post_id}",
+            "is_video": media_type == "video",
+        }
+        if media_type == "image":
+            post["preview"] = {"enabled": True, "images": [{
+                "id": post_id,
+                "source": {"url": f"{self.base_url}/media/{post_id}.jpg",
+                           "width": 1920, "height": 1080},
+                "resolutions": [{"url": f"{self.base_url}/media/{post_id}_640.jpg",
+                                 "width": 640, "height": 360}],
+            }]}
+        elif media_type == "gallery":
+            items = [f"{post_id}_{n}" for n in range(4)]
+            post["media_metadata"] = {media_id: {
+                "status": "valid", "e": "Image", "m": "image/jpg",
+                "p": [{"x": 640, "y": 360, "u": f"{self.base_url}/media/{media_id}_640.jpg"}],
+                "s": {"x": 1920, "y": 1080, "u": f"{self.base_url}/media/{media_id}.jpg"},
+            } for media_id in items}
+            post["gallery_data"] = {"items": [{"media_id": media_id, "id": n}
+                                              for n, media_id in enumerate(items)]}
+        else:
+            post["media"] = {"reddit_video": {
+                "fallback_url": f"{self.base_url}/media/{post_id}/DASH_480.mp4",
+                "width": 854, "height": 480,
+                "scrubber_media_url": "", "duration": 10, "dash_url": "", "hls_url": "",
+                "is_gif": True, "transcoding_status": "completed",
+            }}
+        return post
+
+
+class FakeTelegram:
+    """
+    Bot API stand-in with configurable latency, per chat limits, random flood waits
+    and upload throughput
+    """
+
+    def __init__(self, reddit: FakeReddit, latency: float, chat_rate: float, flood_rate: float,
+                 upload_throughput: float):
+        self.reddit = reddit
+        self.latency = latency
+        self.chat_rate = chat_rate
+        self.flood_rate = flood_rate
+        self.upload_throughput = upload_throughput
+
+        self.calls: Counter = Counter()
+        self.flood_waits = 0
+        self.chat_calls: Dict[str, Deque[float]] = defaultdict(deque)
+        # message id -> post id, copied messages refer to them
+        self.messages: Dict[int, str | None] = {}
+        self.delivered: Dict[str, List[float]] = defaultdict(list)
+
+    def register(self, app: web.Application):
+        app.router.add_post("/bot{token}/{method}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            payload = await request.json()
+        else:
+            payload = dict(await request.post())
+            if self.upload_throughput:
+                await asyncio.sleep((request.content_length or 0) / self.upload_throughput)
+        await asyncio.sleep(random.expovariate(1 / self.latency) if self.latency else 0)
+
+        chat_id = str(payload.get("chat_id"))
+        if self.throttled(chat_id):
+            self.flood_waits += 1
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": "Too Many Requests",
+                                      "parameters": {"retry_after": 1}}, status=429)
+
+        if method == "copyMessage":
+            post_id = self.messages.get(int(payload["message_id"]))
+            message_id = self.deliver(chat_id, post_id)
+            return web.json_response({"ok": True, "result": {"message_id": message_id}})
+
+        caption = payload.get("caption") or ""
+        if method == "sendMediaGroup":
+            media = payload["media"]
+            if type(media) is not list:
+                media = json.loads(media)
+            caption = media[0].get("caption") or ""
+        match = re.search(r"/posts/([^\"]+)\"", caption)
+        message_id = self.deliver(chat_id, match.group(1) if match else None)
+        message = {"message_id": message_id, "chat": {"id": int(chat_id), "type": "private"}}
+        return web.json_response({"ok": True,
+                                  "result": [message] if method == "sendMediaGroup" else message})
+
+    def throttled(self, chat_id: str) -> bool:
+        if self.flood_rate and random.random() < self.flood_rate:
+            return True
+        if not self.chat_rate:
+            return False
+        now = time.time()
+        calls = self.chat_calls[chat_id]
+        while calls and calls[0] < now - 1:
+            calls.popleft()
+        if len(calls) >= self.chat_rate:
+            return True
+        calls.append(now)
+        return False
+
+    def deliver(self, chat_id: str, post_id: str | None) -> int:
+        message_id = len(self.messages) + 1
+        self.messages[message_id] = post_id
+        if post_id in self.reddit.created:
+            self.delivered[post_id].append(time.time() - self.reddit.created[post_id])
+        return message_id
+
+
+async def start_app(*fakes, port: int) -> web.AppRunner:
+    app = web.Application(client_max_size=1024 ** 3)
+    for fake in fakes:
+        fake.register(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def percentile(values: List[float], q: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[q - 1]
+
+
+def report(reddit: FakeReddit, telegram: FakeTelegram, duration: float):
+    latencies = [latency for post_latencies in telegram.delivered.values()
+                 for latency in post_latencies]
+    posts = len(telegram.delivered)
+    calls = sum(telegram.calls.values())
+    print(f"duration                 {duration:10.1f} s")
+    print(f"reddit requests          {reddit.requests:10}")
+    print(f"posts created            {len(reddit.created):10}")
+    print(f"posts delivered          {posts:10} ({posts / duration:.2f}/s)")
+    print(f"deliveries               {len(latencies):10} ({len(latencies) / duration:.2f}/s)")
+    for q in (50, 90, 99):
+        print(f"delivery latency p{q:<6} {percentile(latencies, q):10.2f} s")
+    print(f"api calls per post       {calls / posts if posts else 0:10.2f}")
+    print(f"api calls                {dict(telegram.calls)}")
+    print(f"flood waits              {telegram.flood_waits:10}")
+    # ru_maxrss is in kilobytes on linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"max rss                  {max_rss:10.1f} MB")
+
+
+async def main(args):
+    settings = get_settings()
+    reddit_url = f"http://127.0.0.1:{args.reddit_port}"
+    settings.RD_BASE_URL = f"{reddit_url}/r/"
+    settings.BOT_URL = f"http://127.0.0.1:{args.telegram_port}/bot"
+    settings.bot_token = TOKEN
+    settings.bot_tokens = []
+    settings.telegram_rate_limit = args.rate_limit
+
+    reddit = FakeReddit(reddit_url, args.post_rate, args.media_weights, args.media_size)
+    telegram = FakeTelegram(reddit, args.latency, args.chat_rate, args.flood_rate,
+                            args.upload_throughput)
+    runners = [await start_app(reddit, port=args.reddit_port),
+               await start_app(telegram, port=args.telegram_port)]
+
+    run_id = uuid.uuid4().hex[:6]
+    bot_id = TOKEN.split(":")[0]
+    subscriptions = [(f"reddit@{PREFIX}{run_id}_{listing}#new#",
+                      f"telegram_{bot_id}@{listing * args.subscribers + n}")
+                     for listing in range(args.listings) for n in range(args.subscribers)]
+    async with async_session() as db:
+        for index in range(0, len(subscriptions), 5000):
+            await add_subscriptions(db, subscriptions[index:index + 5000])
+        await db.commit()
+    print(f"Subscribed {args.subscribers} chats to each of {args.listings} listings")
+
+    scrapper = RedditScrapper()
+    scrapper.default_pause = scrapper.pause = args.poll_interval
+    messenger = TelegramMessenger(TOKEN)
+    services = [asyncio.create_task(service) for service in (
+        scrapper.serve(), Web2TgBot().serve(), messenger.serve(),
+        messenger.retry_scheduler.serve())]
+
+    started = time.time()
+    try:
+        done, _ = await asyncio.wait(services, timeout=args.duration,
+                                     return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    finally:
+        for task in services:
+            task.cancel()
+        await asyncio.gather(*services, return_exceptions=True)
+        report(reddit, telegram, time.time() - started)
+
+        for runner in runners:
+            await runner.cleanup()
+        async with async_session() as db:
+            await db.execute(delete(MediaSource)
+                             .where(MediaSource.media_source.startswith(f"reddit@{PREFIX}")))
+            await db.commit()
+        await SubscriptionNotifier(get_new_redis()).notify_reload()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test the pipeline against fake reddit and Telegram servers")
+    parser.add_argument("--listings", type=int, default=10)
+    parser.add_argument("--subscribers", type=int, default=10,
+                        help="chats subscribed to each listing")
+    parser.add_argument("--post-rate", type=float, default=0.2,
+                        help="new posts per second per listing")
+    parser.add_argument("--media-weights", type=float, nargs=3, default=[0.6, 0.2, 0.2],
+                        metavar=("IMAGE", "GALLERY", "VIDEO"))
+    parser.add_argument("--media-size", type=int, default=1024 * 1024,
+                        help="size of fake video files")
+    parser.add_argument("--poll-interval", type=float, default=0.5,
+                        help="scrapper pause between listing requests")
+    parser.add_argument("--latency", type=float, default=0.05, help="mean Bot API latency, seconds")
+    parser.add_argument("--chat-rate", type=float, default=1,
+                        help="calls per second per chat before 429")
+    parser.add_argument("--flood-rate", type=float, default=0.0,
+                        help="share of calls answered with 429")
+    parser.add_argument("--upload-throughput", type=float, default=10 * 1024 * 1024,
+                        help="bytes per second")
+    parser.add_argument("--rate-limit", type=float, default=30,
+                        help="telegram_rate_limit of the messenger")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--reddit-port", type=int, default=8181)
+    parser.add_argument("--telegram-port", type=int, default=8182)
+    asyncio.run(main(parser.parse_args()))
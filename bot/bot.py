@@ -1,49 +1,105 @@
 import asyncio
-import logging.config
-from typing import List
+from typing import List, Dict, Set, Awaitable
 
 from pydantic import parse_raw_as
 from logging import getLogger
 
 from bot.common.configuration import get_configuration, TooManySubs
+from bot.common.logs import setup_logging
 from bot.common.models import IncomingMessage, Post, OutboundMessage
+from bot.common.partitioning import split_by_partition
 from bot.common.pubsub import get_new_pubsub
 from bot.common.redis import get_new_redis
+from bot.common.routing import RoutingTable
+from bot.common.settings import get_settings
+from bot.common.tracing import mark_routed
 from bot.scrap.reddit_models import SubredditListing, BadRedditUrlException
+from bot.startup import run_service
 
 
 class Web2TgBot:
     def __init__(self):
+        settings = get_settings()
         self.pubsub = get_new_pubsub()
         self.redis = get_new_redis()
         self.logger = getLogger()
         self.configuration = get_configuration()
+        self.routing = RoutingTable(self.configuration, self.redis)
+
+        self.post_slots = asyncio.Semaphore(settings.bot_post_workers)
+        self.command_slots = asyncio.Semaphore(settings.bot_command_workers)
+        # conversation -> [lock, number of commands using it]
+        self.conversation_locks: Dict[str, list] = {}
+        self.tasks: Set[asyncio.Task] = set()
 
     async def serve(self):
+        await self.routing.load()
+
+        # separate consumers so interactive commands never wait behind a burst of posts
+        await asyncio.gather(self.routing.serve(), self.serve_commands(), self.serve_posts())
+
+    async def serve_commands(self):
         pubsub = get_new_pubsub()
-        reader = pubsub.stream_messages("incoming_message", "media")
+        reader = pubsub.stream_messages("incoming_message")
         async for channel_id, message_id, message_raw in reader:
-            if channel_id == "media":
-                post: Post = parse_raw_as(Post, message_raw)
-                self.logger.debug("Got new post %s", post)
+            message: IncomingMessage = parse_raw_as(IncomingMessage, message_raw)
+            self.logger.debug("Got incoming message %s", message)
 
-                await self.process_post(post)
+            await self.command_slots.acquire()
+            self.spawn(self.handle_command(message), self.command_slots)
 
-            elif channel_id == "incoming_message":
-                message: IncomingMessage = parse_raw_as(IncomingMessage, message_raw)
-                self.logger.debug("Got incoming message %s", message)
+            await pubsub.ack_message(channel_id, message_id)
 
-                await self.process_incoming_message(message)
+    async def serve_posts(self):
+        pubsub = get_new_pubsub()
+        reader = pubsub.stream_messages("media")
+        async for channel_id, message_id, message_raw in reader:
+            post: Post = parse_raw_as(Post, message_raw)
+            self.logger.debug("Got new post %s %s", post.source_id, post.url)
 
-            await self.pubsub.ack_message(channel_id, message_id)
+            # waiting for a free slot stops reading, so a burst stays in the queue instead of memory
+            await self.post_slots.acquire()
+            self.spawn(self.process_post(post), self.post_slots)
+
+            await pubsub.ack_message(channel_id, message_id)
+
+    def spawn(self, coro: Awaitable, slots: asyncio.Semaphore):
+        async def run():
+            try:
+                await coro
+            except Exception:
+                self.logger.exception("Failed to process message")
+            finally:
+                slots.release()
+
+        task = asyncio.create_task(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handle_command(self, message: IncomingMessage):
+        # commands of one conversation are handled in order, e.g. /start then /list
+        key = f"{message.provider}@{message.conversation_id}"
+        lock_item = self.conversation_locks.setdefault(key, [asyncio.Lock(), 0])
+        lock_item[1] += 1
+        try:
+            async with lock_item[0]:
+                await self.process_incoming_message(message)
+        finally:
+            lock_item[1] -= 1
+            if not lock_item[1]:
+                del self.conversation_locks[key]
 
     async def send_message(self, dest: str,  conversations: List[str], *,
                            post: Post | None = None, text: str | None = None):
-        self.logger.debug("Will send %s to %s: %s", post or text, dest, conversations)
-        await self.pubsub.publish(dest, OutboundMessage(post=post, text=text, conversation_ids=conversations).json())
+        self.logger.debug("Will send %s to %s: %s conversations",
+                          post.url if post else text, dest, len(conversations))
+        for channel, channel_conversations in split_by_partition(dest, conversations).items():
+            message = OutboundMessage(post=post, text=text, conversation_ids=channel_conversations)
+            await self.pubsub.publish(channel, message.json())
 
     async def process_post(self, post: Post):
-        destinations = await self.configuration.find_subs(post.source_id)
+        destinations = self.routing.find_subs(post.source_id)
+        mark_routed(post)
         for dest, convs in destinations.items():
             await self.send_message(dest, convs, post=post)
 
@@ -83,9 +139,13 @@ class Web2TgBot:
                                     text=reply_text)
 
 
+# services waited for before main starts
+DEPENDENCIES = ("db", "rabbitmq", "redis")
+
+
 async def main():
     await Web2TgBot().serve()
 
 if __name__ == "__main__":
-    logging.config.fileConfig("logger.ini")
-    asyncio.run(main())
+    setup_logging()
+    run_service(main, DEPENDENCIES)
@@ -1,6 +1,7 @@
 from aioredis import Redis
 import time
 
+from bot.common.metrics import CACHE_REQUESTS
 from bot.common.redis import get_new_redis
 
 
@@ -21,6 +22,7 @@ class RedisCache(Cache):
     async def cache_item(self, cache_name: str, item: str) -> bool:
         result = await self.redis.zadd(cache_name, mapping={item: time.time()})
         await self.strip(cache_name)  # todo: run it once in a while?
+        CACHE_REQUESTS.labels("miss" if result > 0 else "hit").inc()
         return result > 0
 
     async def has_cache(self, cache_name: str) -> bool:
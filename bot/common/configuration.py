@@ -1,13 +1,11 @@
 from functools import lru_cache
 from logging import getLogger
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
-from bot.common.crud import find_or_add_media_source, add_conversation_for_media_source, \
-    delete_conversation_for_media_source, \
-    get_conversations_for_media_source, get_media_sources, delete_media_source, get_media_sources_for_conversation
 from bot.common.models import IncomingMessage
+from bot.common.redis import get_new_redis
+from bot.common.routing import SubscriptionNotifier
 from bot.common.settings import get_settings
-from bot.db.database import async_session
 from bot.scrap.reddit_models import SubredditListing
 
 logger = getLogger("config")
@@ -37,16 +35,26 @@ class AbstractConfiguration:
     async def find_sources(self, conversation_id: str) -> List[str]:
         pass
 
+    async def get_subscriptions(self) -> List[Tuple[str, str]]:
+        pass
+
 
 class PGConfiguration(AbstractConfiguration):
 
-    def __init__(self):
+    def __init__(self, notifier: SubscriptionNotifier | None = None):
+        # sqlalchemy and the models are imported only by processes using the database
+        from bot.common import crud
+        from bot.db.database import async_session
+
         self.logger = getLogger()
+        self.notifier = notifier
+        self.crud = crud
+        self.session = async_session
 
     async def find_subs(self, source_id: str) -> Dict[str, List[str]]:
         result: Dict[str, List[str]] = {}
-        async with async_session() as db:
-            items = await get_conversations_for_media_source(db, source_id)
+        async with self.session() as db:
+            items = await self.crud.get_conversations_for_media_source(db, source_id)
             self.logger.debug("Found subs for %s %s", source_id, items)
             for item in items:
                 provider, conversation_id = item.split("@")
@@ -56,39 +64,42 @@ class PGConfiguration(AbstractConfiguration):
     async def add_reddit_sub(self, listing: SubredditListing, message: IncomingMessage) -> None:
         self.logger.debug("Adding new reddit sub %s, %s %s", listing.to_str_tuple(), message.provider,
                           message.conversation_id)
+        full_id = "reddit@" + listing.to_str_tuple()
         conv_id = f"{message.provider}@{message.conversation_id}"
-        async with async_session() as db:
-            existing = await get_media_sources_for_conversation(db, conv_id)
-            if len(existing) > get_settings().max_sources:
-                raise TooManySubs()
+        max_sources = get_settings().max_sources
+        async with self.session() as db:
+            existing, added = await self.crud.add_subscription(db, full_id, conv_id, max_sources)
+        if existing > max_sources:
+            raise TooManySubs()
 
-            source = await find_or_add_media_source(db, "reddit@" + listing.to_str_tuple())
-            await add_conversation_for_media_source(db, conv_id, source)
+        if added and self.notifier:
+            await self.notifier.notify("add", full_id, conv_id)
 
     async def rm_reddit_sub(self, listing: SubredditListing, message: IncomingMessage) -> None:
         self.logger.debug("Removing reddit sub %s, %s %s", listing.to_str_tuple(), message.provider,
                           message.conversation_id)
 
         full_id = "reddit@" + listing.to_str_tuple()
-        async with async_session() as db:
-            await delete_conversation_for_media_source(
-                db,
-                full_id,
-                f"{message.provider}@{message.conversation_id}"
-            )
+        conv_id = f"{message.provider}@{message.conversation_id}"
+        async with self.session() as db:
+            await self.crud.remove_subscription(db, full_id, conv_id)
 
-            if not await get_conversations_for_media_source(db, full_id):
-                await delete_media_source(db, full_id)
+        if self.notifier:
+            await self.notifier.notify("rm", full_id, conv_id)
 
     async def get_sources(self) -> List[str]:
-        async with async_session() as db:
-            return await get_media_sources(db)
+        async with self.session() as db:
+            return await self.crud.get_media_sources(db)
 
     async def find_sources(self, conversation_id: str) -> List[str]:
-        async with async_session() as db:
-            return await get_media_sources_for_conversation(db, conversation_id)
+        async with self.session() as db:
+            return await self.crud.get_media_sources_for_conversation(db, conversation_id)
+
+    async def get_subscriptions(self) -> List[Tuple[str, str]]:
+        async with self.session() as db:
+            return await self.crud.get_subscriptions(db)
 
 
 @lru_cache
 def get_configuration() -> AbstractConfiguration:
-    return PGConfiguration()
+    return PGConfiguration(SubscriptionNotifier(get_new_redis()))
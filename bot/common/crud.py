@@ -1,10 +1,8 @@
-from typing import List
+from typing import List, Tuple, AsyncIterator, Iterable
 
-from sqlalchemy import select, delete
-from sqlalchemy.cimmutabledict import immutabledict
-from sqlalchemy.engine import CursorResult
+from sqlalchemy import select, delete, func, literal, exists
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
 from bot.common.db_models import MediaSource, Conversation
 
@@ -17,75 +15,136 @@ class DBNotFoundException(DBException):
     pass
 
 
-async def find_or_add_media_source(db: AsyncSession, media_source: str):
-    statement = select(MediaSource) \
-        .filter(MediaSource.media_source == media_source) \
-        .options(selectinload(MediaSource.conversation))
-    res = await db.execute(statement)
-    if o := res.scalars().first():
-        return o
-
-    media_source = MediaSource(
-        media_source=media_source
-    )
-    db.add(media_source)
-    await db.commit()
-    return media_source
-
-
 async def get_media_sources(db: AsyncSession) -> List[str]:
-    statement = select(MediaSource)
+    statement = select(MediaSource.media_source)
     res = await db.execute(statement)
-    return [item.media_source for item in res.scalars().all()]
-
-
-async def delete_media_source(db: AsyncSession, media_source: str):
-    statement = delete(MediaSource) \
-        .filter(MediaSource.media_source == media_source)
-    res: CursorResult = await db.execute(statement)
-    await db.commit()
-    if res.rowcount != 1:
-        raise DBException("Not found")
-
-
-async def add_conversation_for_media_source(db: AsyncSession,
-                                            conversation: str,
-                                            media_source: MediaSource) -> Conversation:
-    conv = Conversation(
-        conversation=conversation,
-    )
-    conv.media_source = media_source
-    db.add(conv)
-    await db.commit()
-    return conv
+    return list(res.scalars().all())
 
 
-async def get_conversations_for_media_source(db: AsyncSession, media_source: str):
-    statement = select(MediaSource) \
-        .filter(MediaSource.media_source == media_source) \
-        .options(selectinload(MediaSource.conversation))
+async def get_conversations_for_media_source(db: AsyncSession, media_source: str) -> List[str]:
+    statement = select(Conversation.conversation) \
+        .join(MediaSource, Conversation.media_source_id == MediaSource.id) \
+        .where(MediaSource.media_source == media_source)
     res = await db.execute(statement)
+    return list(res.scalars().all())
 
-    ms: MediaSource = res.scalars().first()
-
-    return [item.conversation for item in ms.conversation]
 
+async def get_media_sources_for_conversation(db: AsyncSession, conversation: str) -> List[str]:
+    statement = select(MediaSource.media_source) \
+        .join(Conversation, Conversation.media_source_id == MediaSource.id) \
+        .where(Conversation.conversation == conversation)
+    res = await db.execute(statement)
+    return list(res.scalars().all())
 
-async def delete_conversation_for_media_source(db: AsyncSession, media_source: str, conversation: str):
-    statement = delete(Conversation).where(
-        Conversation.conversation == conversation,
-        Conversation.media_source.has(MediaSource.media_source == media_source),
-    )
 
-    res: CursorResult = await db.execute(statement, execution_options=immutabledict({"synchronize_session": 'fetch'}))
+async def get_subscriptions(db: AsyncSession) -> List[Tuple[str, str]]:
+    statement = select(MediaSource.media_source, Conversation.conversation) \
+        .join(Conversation, Conversation.media_source_id == MediaSource.id)
+    res = await db.execute(statement)
+    return [(media_source, conversation) for media_source, conversation in res.all()]
+
+
+async def add_subscription(db: AsyncSession, media_source: str, conversation: str,
+                           max_sources: int) -> Tuple[int, bool]:
+    """
+    Subscribes conversation to media source in a single statement, creating the media source
+    if needed. Nothing is written when the conversation already has more than `max_sources`
+    subscriptions. Returns number of subscriptions the conversation had before and whether
+    a new one was added
+    """
+    existing = select(func.count()).select_from(Conversation) \
+        .where(Conversation.conversation == conversation) \
+        .scalar_subquery()
+
+    # DO UPDATE instead of DO NOTHING so RETURNING yields id of an already existing source
+    source_insert = insert(MediaSource) \
+        .from_select([MediaSource.media_source],
+                     select(literal(media_source)).where(existing <= max_sources))
+    source = source_insert \
+        .on_conflict_do_update(index_elements=[MediaSource.media_source],
+                               set_={"media_source": source_insert.excluded.media_source}) \
+        .returning(MediaSource.id) \
+        .cte("source")
+
+    added = insert(Conversation) \
+        .from_select([Conversation.conversation, Conversation.media_source_id],
+                     select(literal(conversation), source.c.id)) \
+        .on_conflict_do_nothing(index_elements=[Conversation.conversation,
+                                                Conversation.media_source_id]) \
+        .returning(Conversation.id) \
+        .cte("added")
+
+    statement = select(existing, select(func.count()).select_from(added).scalar_subquery())
+    res = await db.execute(statement)
+    existing_count, added_count = res.one()
     await db.commit()
-    if res.rowcount != 1:
-        raise DBException("Not found")
-
-
-async def get_media_sources_for_conversation(db: AsyncSession, conversation: str):
-    statement = select(MediaSource).filter(
-        MediaSource.conversation.any(Conversation.conversation == conversation)
-    )
+    return existing_count, added_count > 0
+
+
+async def remove_subscription(db: AsyncSession, media_source: str, conversation: str) -> None:
+    """
+    Unsubscribes conversation and drops the media source without subscribers in a single statement
+    """
+    removed = delete(Conversation) \
+        .where(Conversation.conversation == conversation,
+               Conversation.media_source_id == MediaSource.id,
+               MediaSource.media_source == media_source) \
+        .returning(Conversation.id) \
+        .cte("removed")
+
+    # rows removed by the CTE are still visible to the other parts of the statement,
+    # so they are excluded explicitly
+    others = exists() \
+        .where(Conversation.media_source_id == MediaSource.id,
+               Conversation.id.not_in(select(removed.c.id)))
+    dropped = delete(MediaSource) \
+        .where(MediaSource.media_source == media_source, exists(select(removed.c.id)), ~others) \
+        .returning(MediaSource.id) \
+        .cte("dropped")
+
+    statement = select(select(func.count()).select_from(removed).scalar_subquery(),
+                       select(func.count()).select_from(dropped).scalar_subquery())
     res = await db.execute(statement)
-    return [item.media_source for item in res.scalars().all()]
+    removed_count, _ = res.one()
+    await db.commit()
+    if not removed_count:
+        raise DBNotFoundException("Not found")
+
+
+async def iter_subscriptions(db: AsyncSession) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Streams (media source, conversation) pairs ordered by media source
+    """
+    statement = select(MediaSource.media_source, Conversation.conversation) \
+        .join(Conversation, Conversation.media_source_id == MediaSource.id) \
+        .order_by(MediaSource.media_source, Conversation.id)
+    res = await db.stream(statement)
+    async for media_source, conversation in res:
+        yield media_source, conversation
+
+
+async def add_subscriptions(db: AsyncSession, subscriptions: Iterable[Tuple[str, str]]) -> int:
+    """
+    Bulk insert of (media source, conversation) pairs, existing ones are skipped.
+    Does not commit, returns number of added subscriptions
+    """
+    subscriptions = list(subscriptions)
+    media_sources = list({media_source for media_source, _ in subscriptions})
+    if not media_sources:
+        return 0
+
+    await db.execute(insert(MediaSource)
+                     .values([{"media_source": media_source} for media_source in media_sources])
+                     .on_conflict_do_nothing(index_elements=[MediaSource.media_source]))
+    res = await db.execute(select(MediaSource.media_source, MediaSource.id)
+                           .where(MediaSource.media_source.in_(media_sources)))
+    ids = dict(res.all())
+
+    res = await db.execute(insert(Conversation)
+                           .values([{"conversation": conversation,
+                                     "media_source_id": ids[media_source]}
+                                    for media_source, conversation in subscriptions])
+                           .on_conflict_do_nothing(index_elements=[Conversation.conversation,
+                                                                   Conversation.media_source_id])
+                           .returning(Conversation.id))
+    return len(res.all())
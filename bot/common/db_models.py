@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, ForeignKey
+from sqlalchemy import Column, String, Integer, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 from bot.db.base_class import Base
@@ -21,3 +21,8 @@ class Conversation(Base):
 
     media_source_id = Column(Integer, ForeignKey("media_sources.id", ondelete="CASCADE"))
     media_source = relationship("MediaSource", back_populates="conversation")
+
+    __table_args__ = (
+        Index("ix_conversations_conversation_media_source_id", "conversation", "media_source_id",
+              unique=True),
+    )
@@ -0,0 +1,224 @@
+"""
+Opt-in runtime diagnostics: event loop lag, stack traces of callbacks blocking the loop,
+a sampling profiler and tracemalloc snapshots. Profiles and snapshots are dumped to diagnostics_dir.
+
+SIGUSR1 starts/stops the profiler, SIGUSR2 starts tracemalloc or takes a snapshot.
+With admin_port set the same is available over HTTP:
+POST /debug/profile/start, /debug/profile/stop,
+     /debug/tracemalloc/start, /debug/tracemalloc/snapshot
+"""
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from logging import getLogger
+from types import FrameType
+
+from aiohttp import web
+
+from bot.common.metrics import EVENT_LOOP_LAG
+from bot.common.settings import get_settings
+
+logger = getLogger("diagnostics")
+
+
+def frame_stack(frame: FrameType) -> str:
+    # collapsed stack, root first, as used by flamegraph tools
+    names = []
+    current: FrameType | None = frame
+    while current:
+        code = current.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{current.f_lineno})")
+        current = current.f_back
+    return ";".join(reversed(names))
+
+
+class LoopMonitor:
+    """
+    Measures how late the loop wakes up a sleeping task.
+    A watchdog thread logs the stack of the loop thread when the loop is blocked
+    for longer than slow_callback.
+    """
+
+    def __init__(self, interval: float, slow_callback: float):
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+
+    async def serve(self):
+        watchdog = threading.Thread(target=self.watch, name="loop-watchdog", daemon=True)
+        watchdog.start()
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                expected = loop.time() + self.interval
+                self.heartbeat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                lag = max(loop.time() - expected, 0)
+                EVENT_LOOP_LAG.observe(lag)
+                if lag > self.slow_callback:
+                    logger.warning("Event loop lag %.3fs", lag)
+        finally:
+            self.stopped.set()
+
+    def watch(self):
+        reported = 0.0
+        while not self.stopped.wait(self.slow_callback / 2):
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked > self.slow_callback and heartbeat != reported:
+                reported = heartbeat
+                frame = sys._current_frames().get(self.loop_thread_id)
+                if frame:
+                    logger.warning("Event loop blocked for %.3fs at:\n%s",
+                                   blocked, "".join(traceback.format_stack(frame)))
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the loop thread from a background thread,
+    results are folded stacks with counts
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.samples: Counter = Counter()
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def start(self):
+        self.samples = Counter()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.sample, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> Counter:
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.thread = None
+        return self.samples
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame:
+                self.samples[frame_stack(frame)] += 1
+
+
+def write_folded(filename: str, samples: Counter):
+    with open(filename, "w") as f:
+        f.writelines(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+
+class Diagnostics:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.profiler = SamplingProfiler()
+        self.monitor_task: asyncio.Task | None = None
+
+    def dump_path(self, kind: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{kind}-{os.getpid()}-{int(time.time())}.{extension}")
+
+    def start_profile(self) -> str:
+        if not self.profiler.running:
+            self.profiler.start()
+            logger.info("Profiler started")
+        return "profiling"
+
+    async def stop_profile(self) -> str:
+        if not self.profiler.running:
+            return "profiler is not running"
+        samples = await asyncio.to_thread(self.profiler.stop)
+        path = self.dump_path("profile", "folded")
+        await asyncio.to_thread(write_folded, path, samples)
+        logger.info("Profile with %s samples written to %s", sum(samples.values()), path)
+        return path
+
+    def start_tracemalloc(self) -> str:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            logger.info("Tracemalloc started")
+        return "tracing"
+
+    async def snapshot(self) -> str:
+        if not tracemalloc.is_tracing():
+            return "tracemalloc is not running"
+        snapshot = tracemalloc.take_snapshot()
+        path = self.dump_path("tracemalloc", "snapshot")
+        await asyncio.to_thread(snapshot.dump, path)
+        for stat in snapshot.statistics("lineno")[:10]:
+            logger.info("%s", stat)
+        logger.info("Tracemalloc snapshot written to %s", path)
+        return path
+
+    async def toggle_profile(self):
+        if self.profiler.running:
+            await self.stop_profile()
+        else:
+            self.start_profile()
+
+    async def toggle_tracemalloc(self):
+        if tracemalloc.is_tracing():
+            await self.snapshot()
+        else:
+            self.start_tracemalloc()
+
+    def register(self, app: web.Application):
+        app.router.add_post("/debug/profile/start", self.handle_profile_start)
+        app.router.add_post("/debug/profile/stop", self.handle_profile_stop)
+        app.router.add_post("/debug/tracemalloc/start", self.handle_tracemalloc_start)
+        app.router.add_post("/debug/tracemalloc/snapshot", self.handle_tracemalloc_snapshot)
+
+    async def handle_profile_start(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.start_profile() + "\n")
+
+    async def handle_profile_stop(self, request: web.Request) -> web.Response:
+        return web.Response(text=await self.stop_profile() + "\n")
+
+    async def handle_tracemalloc_start(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.start_tracemalloc() + "\n")
+
+    async def handle_tracemalloc_snapshot(self, request: web.Request) -> web.Response:
+        return web.Response(text=await self.snapshot() + "\n")
+
+
+async def start_diagnostics() -> Diagnostics | None:
+    """
+    Starts the loop monitor, signal handlers and the admin server when diagnostics are enabled.
+    Has to be called from the loop thread.
+    """
+    settings = get_settings()
+    if not settings.diagnostics:
+        return None
+
+    diagnostics = Diagnostics(settings.diagnostics_dir)
+    monitor = LoopMonitor(settings.loop_lag_interval, settings.slow_callback_duration)
+    diagnostics.monitor_task = asyncio.create_task(monitor.serve())
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGUSR1,
+                            lambda: asyncio.create_task(diagnostics.toggle_profile()))
+    loop.add_signal_handler(signal.SIGUSR2,
+                            lambda: asyncio.create_task(diagnostics.toggle_tracemalloc()))
+
+    if settings.admin_port:
+        app = web.Application()
+        diagnostics.register(app)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, settings.admin_host, settings.admin_port).start()
+        logger.info("Admin server listens on %s:%s", settings.admin_host, settings.admin_port)
+    return diagnostics
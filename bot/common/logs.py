@@ -0,0 +1,123 @@
+"""
+Logging setup of the services: handlers from logger.ini run in a listener thread behind a queue,
+records are rate limited per call site, debug records are sampled and long messages are truncated.
+"""
+import atexit
+import copy
+import hashlib
+import logging
+import logging.config
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Tuple
+
+from bot.common.settings import get_settings
+
+
+def shorten(text: str, max_length: int) -> str:
+    """
+    Keeps the beginning of a long text, the rest is replaced with its size and hash
+    """
+    if len(text) <= max_length:
+        return text
+    digest = hashlib.sha1(text.encode(errors="replace")).hexdigest()[:12]
+    return f"{text[:max_length]}... ({len(text)} chars, sha1 {digest})"
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site, records over the limit are dropped and counted.
+    The next record passing through reports how many were suppressed.
+    Debug records are additionally sampled, warnings and errors never are.
+    """
+
+    def __init__(self, rate: float, burst: int, debug_sample: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.debug_sample = debug_sample
+        # call site -> [tokens, last update, suppressed]
+        self.buckets: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and self.debug_sample < 1 \
+                and random.random() >= self.debug_sample:
+            return False
+        if not self.rate:
+            return True
+
+        now = time.monotonic()
+        bucket = self.buckets.setdefault((record.pathname, record.lineno), [self.burst, now, 0])
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.msg = f"{record.msg} [{bucket[2]} similar messages suppressed]"
+            bucket[2] = 0
+        return True
+
+
+class Shortened:
+    """
+    Converts the wrapped object to a string and shortens it only when the record is formatted
+    """
+    __slots__ = ("value", "max_length")
+
+    def __init__(self, value: Any, max_length: int):
+        self.value = value
+        self.max_length = max_length
+
+    def __str__(self) -> str:
+        return shorten(str(self.value), self.max_length)
+
+    def __repr__(self) -> str:
+        return shorten(repr(self.value), self.max_length)
+
+
+class TruncatingQueueHandler(QueueHandler):
+    """
+    With max_length set records are formatted by the listener thread instead of the logging one,
+    message and arguments are shortened there, exception tracebacks are kept whole
+    """
+    def __init__(self, log_queue: queue.SimpleQueue, max_length: int):
+        super().__init__(log_queue)
+        self.max_length = max_length
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if not self.max_length:
+            return super().prepare(record)
+        record = copy.copy(record)
+        if isinstance(record.args, tuple):
+            # numbers are kept for %d and similar conversions
+            record.args = tuple(arg if arg is None or isinstance(arg, (int, float))
+                                else Shortened(arg, self.max_length) for arg in record.args)
+        elif not record.args:
+            record.msg = Shortened(record.msg, self.max_length)
+        return record
+
+
+def setup_logging(config: str = "logger.ini") -> QueueListener:
+    """
+    Applies logging config and moves the configured root handlers to a listener thread
+    """
+    settings = get_settings()
+    logging.config.fileConfig(config, disable_existing_loggers=False)
+
+    root = logging.getLogger()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    handler = TruncatingQueueHandler(log_queue, settings.log_max_length)
+    handler.addFilter(RateLimitFilter(settings.log_rate_limit, settings.log_rate_burst,
+                                      settings.log_debug_sample))
+    for configured in list(root.handlers):
+        root.removeHandler(configured)
+    root.addHandler(handler)
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
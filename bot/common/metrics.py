@@ -0,0 +1,57 @@
+from logging import getLogger
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from bot.common.settings import get_settings
+
+# process startup phases: imports and waiting for dependencies
+STARTUP_SECONDS = Gauge("startup_seconds", "Duration of startup phases", ["phase"])
+
+# reddit scrapper
+SCRAPE_LATENCY = Histogram("scrape_latency_seconds", "Reddit listing request latency", ["listing"])
+SCRAPE_THROTTLED = Counter("scrape_throttled_total", "Reddit replies with 429 status", ["listing"])
+SCRAPE_NEW_POSTS = Histogram("scrape_new_posts", "New posts found per listing fetch",
+                             buckets=(0, 1, 2, 5, 10, 25, 50, 100))
+
+# post id cache, hit means the post was seen before
+CACHE_REQUESTS = Counter("cache_requests_total", "Post cache lookups", ["result"])
+
+# pubsub
+PUBSUB_PUBLISHED = Counter("pubsub_published_total", "Messages published", ["channel"])
+PUBSUB_CONSUMED = Counter("pubsub_consumed_total", "Messages consumed", ["channel"])
+PUBSUB_LAG = Histogram("pubsub_lag_seconds", "Time a message spent in the queue", ["channel"],
+                       buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300))
+
+# telegram bot api
+TELEGRAM_LATENCY = Histogram("telegram_request_seconds", "Telegram Bot API request latency",
+                             ["method"])
+TELEGRAM_RETRIES = Counter("telegram_retries_total",
+                           "Telegram requests retried after a client error", ["method"])
+TELEGRAM_FLOOD_WAITS = Counter("telegram_flood_waits_total", "Telegram replies with 429 status",
+                               ["method"])
+TELEGRAM_UPLOADED_BYTES = Counter("telegram_uploaded_bytes_total",
+                                  "Media bytes uploaded to telegram", ["method"])
+
+# post pipeline: scrape (reddit creation to scraping), route, media, deliver and total
+POST_STAGE_LATENCY = Histogram("post_stage_latency_seconds", "Post latency per pipeline stage",
+                               ["stage"],
+                               buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200,
+                                        86400))
+
+# event loop
+EVENT_LOOP_LAG = Histogram("event_loop_lag_seconds", "Delay of a sleeping task wake up",
+                           buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+
+# media
+FFMPEG_DURATION = Histogram("ffmpeg_merge_seconds", "Video and audio merge duration",
+                            buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300))
+
+
+def start_metrics_server() -> None:
+    """
+    Serves /metrics on metrics_port, does nothing when it is not set
+    """
+    port = get_settings().metrics_port
+    if port:
+        getLogger().info("Serving metrics on port %s", port)
+        start_http_server(port)
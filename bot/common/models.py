@@ -11,12 +11,29 @@ class IncomingMessage(BaseModel):
     message_id: str | None
 
 
+class MediaSize(BaseModel):
+    width: int
+    height: int
+
+
 class MediaItem(BaseModel):
+    # variants from the smallest to the original one
     urls: List[str]
+    # dimensions of urls if known
+    sizes: List[MediaSize] | None
     caption: str | None
     audio: str | None
 
 
+class PostTrace(BaseModel):
+    # unix timestamps of pipeline stages, filled in by the scrapper, the bot and the messenger
+    trace_id: str
+    created: float | None
+    scraped: float | None
+    routed: float | None
+    media_ready: float | None
+
+
 class Post(BaseModel):
     source_id: str
     source_text: str | None
@@ -25,9 +42,18 @@ class Post(BaseModel):
     url: str
     images: List[MediaItem] | None
     videos: List[MediaItem] | None
+    trace: PostTrace | None
 
 
 class OutboundMessage(BaseModel):
     conversation_ids: List[str]
     post: Post | None
     text: str | None
+    attempt: int = 0
+
+
+class SubscriptionChange(BaseModel):
+    version: int
+    action: str  # add|rm|reload
+    media_source: str
+    conversation: str
@@ -0,0 +1,42 @@
+import zlib
+from typing import Dict, List, Iterable
+
+from bot.common.settings import get_settings
+
+
+def get_partition(conversation_id: str, partitions: int) -> int:
+    # crc32 is stable across processes unlike built-in hash()
+    return zlib.crc32(conversation_id.encode()) % partitions
+
+
+def partition_channel(dest: str, partition: int, partitions: int) -> str:
+    if partitions <= 1:
+        return dest
+    return f"{dest}_{partition}"
+
+
+def split_by_partition(dest: str, conversations: Iterable[str],
+                       partitions: int | None = None) -> Dict[str, List[str]]:
+    partitions = partitions or get_settings().outbound_partitions
+    result: Dict[str, List[str]] = {}
+    for conversation_id in conversations:
+        channel = partition_channel(dest, get_partition(conversation_id, partitions), partitions)
+        result.setdefault(channel, []).append(conversation_id)
+    return result
+
+
+def parse_partitions(partitions_str: str, partitions: int) -> List[int]:
+    if not partitions_str.strip():
+        return list(range(partitions))
+    result = sorted({int(item) for item in partitions_str.split(",") if item.strip()})
+    for item in result:
+        if not 0 <= item < partitions:
+            raise ValueError(f"Partition {item} is out of range 0..{partitions - 1}")
+    return result
+
+
+def owned_channels(dest: str) -> List[str]:
+    settings = get_settings()
+    return [partition_channel(dest, partition, settings.outbound_partitions)
+            for partition in parse_partitions(settings.messenger_partitions,
+                                              settings.outbound_partitions)]
@@ -1,19 +1,43 @@
 import asyncio
+import time
+import weakref
 from logging import getLogger
-from typing import Any, Tuple, AsyncGenerator
+from typing import Any, Tuple, AsyncGenerator, Sequence
 
 import aio_pika
 import aioredis
-from aio_pika.abc import AbstractRobustConnection, AbstractRobustChannel, AbstractIncomingMessage
+from aio_pika.abc import AbstractRobustConnection, AbstractChannel, AbstractIncomingMessage, \
+    AbstractExchange
 
+from bot.common.metrics import PUBSUB_PUBLISHED, PUBSUB_CONSUMED, PUBSUB_LAG
 from bot.common.redis import get_new_redis
 from bot.common.settings import get_settings
 
+TAP_EXCHANGE = "tap"
+
+# one rabbitmq connection per event loop, pubsub instances open their own channels on it
+_connections: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = \
+    weakref.WeakKeyDictionary()
+
+
+async def get_rabbit_connection() -> AbstractRobustConnection:
+    loop = asyncio.get_running_loop()
+    connecting = _connections.get(loop)
+    if connecting is None or (connecting.done()
+                              and (connecting.cancelled() or connecting.exception())):
+        connecting = loop.create_task(aio_pika.connect_robust(get_settings().rabbitmq))
+        _connections[loop] = connecting
+    return await asyncio.shield(connecting)
+
 
 class Pubsub:
     async def publish(self, channel_id: str, message: str | bytes) -> None:
         pass
 
+    async def publish_many(self, channel_id: str, messages: Sequence[str | bytes]) -> None:
+        for message in messages:
+            await self.publish(channel_id, message)
+
     def stream_messages(self, *args) -> AsyncGenerator[Tuple[str, str | None, str], Any]:
         pass
 
@@ -32,11 +56,19 @@ class PubsubRedis(Pubsub):
         while True:
             res = await self.redis.publish(channel_id, message)
             if not verify_accepted or res:
+                PUBSUB_PUBLISHED.labels(channel_id).inc()
                 break
             self.logger.warning(f"No one accepted a message for channel {channel_id}")
             to_sleep += 1 if to_sleep < 30 else 0
             await asyncio.sleep(to_sleep)
 
+    async def publish_many(self, channel_id: str, messages: Sequence[str | bytes]) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for message in messages:
+                pipe.publish(channel_id, message)
+            await pipe.execute()
+        PUBSUB_PUBLISHED.labels(channel_id).inc(len(messages))
+
     async def stream_messages(self, *args) -> AsyncGenerator[Tuple[str, str | None, str], Any]:
         await self.pubsub.subscribe(*args)
         try:
@@ -46,6 +78,7 @@ class PubsubRedis(Pubsub):
                     continue
                 # {'type': 'message', 'pattern': None, 'channel': 'ch3', 'data': '1551515'}
                 if message.get("type") == "message":
+                    PUBSUB_CONSUMED.labels(message.get("channel")).inc()
                     stop = yield message.get("channel"), None, message.get("data")
                     if stop:
                         break
@@ -58,42 +91,90 @@ class PubsubRabbitmq(Pubsub):
 
     def __init__(self):
         self.connection: AbstractRobustConnection | None = None
-        self.channel: AbstractRobustChannel | None = None
-
-    async def _get_connection(self):
-        if self.connection is None:
-            self.connection = await aio_pika.connect_robust(get_settings().rabbitmq)
-            self.channel = await self.connection.channel()
-        else:
-            await self.connection.ready()
+        self.channel: AbstractChannel | None = None
+        self.tap: AbstractExchange | None = None
+        self.connection_lock = asyncio.Lock()
+
+    async def _get_connection(self) -> AbstractChannel:
+        # several consumers may share one instance, only the first one connects
+        async with self.connection_lock:
+            if self.connection is None or self.channel is None:
+                self.connection = await get_rabbit_connection()
+                channel = await self.connection.channel()
+                if get_settings().pubsub_tap:
+                    self.tap = await channel.declare_exchange(TAP_EXCHANGE,
+                                                              aio_pika.ExchangeType.FANOUT)
+                self.channel = channel
+                return channel
+        await self.connection.ready()
+        return self.channel
 
     async def publish(self, channel_id: str, message: str | bytes) -> None:
-        await self._get_connection()
-        await self.channel.default_exchange.publish(
-            aio_pika.Message(
-                body=message if type(message) is bytes else message.encode()
-            ), routing_key=channel_id)
+        channel = await self._get_connection()
+        rabbit_message = to_rabbit_message(message)
+        await channel.default_exchange.publish(rabbit_message, routing_key=channel_id)
+        if self.tap:
+            # copies nobody records are dropped by the broker instead of being returned
+            await self.tap.publish(rabbit_message, routing_key=channel_id, mandatory=False)
+        PUBSUB_PUBLISHED.labels(channel_id).inc()
+
+    async def publish_many(self, channel_id: str, messages: Sequence[str | bytes]) -> None:
+        # publisher confirms are awaited concurrently instead of one roundtrip per message
+        channel = await self._get_connection()
+        rabbit_messages = [to_rabbit_message(message) for message in messages]
+        publishes = [channel.default_exchange.publish(rabbit_message, routing_key=channel_id)
+                     for rabbit_message in rabbit_messages]
+        if self.tap:
+            publishes += [self.tap.publish(rabbit_message, routing_key=channel_id, mandatory=False)
+                          for rabbit_message in rabbit_messages]
+        await asyncio.gather(*publishes)
+        PUBSUB_PUBLISHED.labels(channel_id).inc(len(messages))
 
     async def stream_messages(self, *args) -> AsyncGenerator[Tuple[str, str | None, str], Any]:
-        await self._get_connection()
-        # await self.channel.basic_qos(prefetch_count=1)
+        channel = await self._get_connection()
+        # await channel.basic_qos(prefetch_count=1)
 
         queue = asyncio.Queue()
 
         async def callback(msg: AbstractIncomingMessage):
+            # consumed with no_ack, the broker does not expect an ack
             await queue.put(msg)
-            print(await msg.ack())
 
         for queue_name in args:
-            q = await self.channel.declare_queue(queue_name, durable=True)
+            q = await channel.declare_queue(queue_name, durable=True)
             await q.consume(callback, no_ack=True)
 
         while True:
             message: AbstractIncomingMessage = await queue.get()
+            PUBSUB_CONSUMED.labels(message.routing_key).inc()
+            published_at = (message.headers or {}).get("published_at")
+            if isinstance(published_at, float):
+                PUBSUB_LAG.labels(message.routing_key).observe(max(time.time() - published_at, 0))
             stop = yield message.routing_key, message.delivery_tag, message.body
             if stop:
                 break
 
+    async def stream_tap(self) -> AsyncGenerator[Tuple[str, float, bytes], Any]:
+        """
+        Copies of all published messages as (channel, publish time, body)
+        """
+        channel = await self._get_connection()
+        exchange = await channel.declare_exchange(TAP_EXCHANGE, aio_pika.ExchangeType.FANOUT)
+        # the queue lives only while the recorder is connected
+        queue = await channel.declare_queue(exclusive=True)
+        await queue.bind(exchange)
+        async with queue.iterator(no_ack=True) as messages:
+            async for message in messages:
+                published_at = (message.headers or {}).get("published_at")
+                yield message.routing_key or "", \
+                    published_at if isinstance(published_at, float) else time.time(), message.body
+
+
+def to_rabbit_message(message: str | bytes) -> aio_pika.Message:
+    # publish time lets consumers measure how long the message was queued
+    return aio_pika.Message(body=message if type(message) is bytes else message.encode(),
+                            headers={"published_at": time.time()})
+
 
 def get_new_pubsub() -> Pubsub:
     return PubsubRabbitmq()
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import time
+import uuid
+from logging import getLogger
+from typing import List, Tuple
+
+from aioredis import Redis
+
+from bot.common.pubsub import Pubsub
+from bot.common.settings import get_settings
+
+RETRY_KEY = "retry_queue"
+DEAD_LETTER_KEY = "dead_letter"
+
+
+class RetryScheduler:
+    """
+    Delayed redelivery of failed messages built on a redis sorted set scored by due time.
+    Messages that failed too many times are moved to the dead letter list.
+    """
+    def __init__(self, redis: Redis, pubsub: Pubsub,
+                 delays: List[int] | None = None, max_attempts: int | None = None,
+                 batch_size: int = 100):
+        self.redis = redis
+        self.pubsub = pubsub
+        self.delays = delays or get_settings().retry_delays
+        self.max_attempts = max_attempts or get_settings().retry_max_attempts
+        self.batch_size = batch_size
+        self.logger = getLogger("RetryScheduler")
+
+    def get_delay(self, attempt: int) -> int:
+        return self.delays[max(1, min(attempt, len(self.delays))) - 1]
+
+    async def retry(self, channel_id: str, message: str, attempt: int, reason: str = "") -> bool:
+        """
+        Schedules redelivery of already failed `attempt` times message.
+        Returns False if the message was dead lettered instead.
+        """
+        if attempt >= self.max_attempts:
+            self.logger.error("Message for %s failed %s times, dead lettering: %s",
+                              channel_id, attempt, reason)
+            await self.redis.rpush(DEAD_LETTER_KEY, json.dumps({
+                "channel": channel_id,
+                "message": message,
+                "attempt": attempt,
+                "reason": reason,
+                "failed_at": time.time(),
+            }))
+            return False
+
+        delay = self.get_delay(attempt)
+        self.logger.warning("Message for %s failed (%s), attempt %s, retry in %ss",
+                            channel_id, reason, attempt, delay)
+        await self.schedule(channel_id, message, delay)
+        return True
+
+    async def schedule(self, channel_id: str, message: str, delay: float):
+        # uuid keeps identical payloads apart in the sorted set
+        item = json.dumps({"id": str(uuid.uuid4()), "channel": channel_id, "message": message})
+        await self.redis.zadd(RETRY_KEY, mapping={item: time.time() + delay})
+
+    async def pop_due(self) -> List[Tuple[str, str]]:
+        result = []
+        items = await self.redis.zrangebyscore(RETRY_KEY, 0, time.time(),
+                                               start=0, num=self.batch_size)
+        for item in items:
+            # several processes may pump the same queue, the one that removed the item owns it
+            if await self.redis.zrem(RETRY_KEY, item):
+                data = json.loads(item)
+                result.append((data["channel"], data["message"]))
+        return result
+
+    async def redeliver(self):
+        for channel_id, message in await self.pop_due():
+            self.logger.debug("Redelivering message to %s", channel_id)
+            try:
+                await self.pubsub.publish(channel_id, message)
+            except Exception:
+                # the message is already removed from the queue,
+                # it is put back instead of being lost
+                self.logger.exception("Failed to redeliver message to %s, rescheduling", channel_id)
+                await self.schedule(channel_id, message, self.get_delay(1))
+
+    async def serve(self, interval: float = 1.0):
+        while True:
+            try:
+                await self.redeliver()
+            except Exception:
+                self.logger.exception("Failed to redeliver messages")
+            await asyncio.sleep(interval)
+
+
+async def pop_dead_letters(redis: Redis, count: int) -> List[dict]:
+    result = []
+    for _ in range(count):
+        item = await redis.lpop(DEAD_LETTER_KEY)
+        if item is None:
+            break
+        result.append(json.loads(item))
+    return result
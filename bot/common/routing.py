@@ -0,0 +1,168 @@
+import asyncio
+from logging import getLogger
+from typing import Dict, List, Set, Callable
+
+from aioredis import Redis
+from pydantic import parse_raw_as
+
+from bot.common.models import SubscriptionChange
+from bot.common.pubsub import PubsubRedis
+from bot.common.settings import get_settings
+
+SUBSCRIPTIONS_CHANNEL = "subscriptions"
+SUBSCRIPTIONS_VERSION_KEY = "subscriptions_version"
+
+
+class SubscriptionNotifier:
+    """
+    Broadcasts subscription changes to every replica, each change gets a new version number
+    """
+    def __init__(self, redis: Redis):
+        self.redis = redis
+
+    async def notify(self, action: str, media_source: str, conversation: str) -> None:
+        version = await self.redis.incr(SUBSCRIPTIONS_VERSION_KEY)
+        change = SubscriptionChange(version=version, action=action, media_source=media_source,
+                                    conversation=conversation)
+        await self.redis.publish(SUBSCRIPTIONS_CHANNEL, change.json())
+
+    async def notify_reload(self) -> None:
+        """
+        Makes every replica reload all subscriptions, e.g. after a restore
+        """
+        await self.notify("reload", "", "")
+
+
+class RoutingTable:
+    """
+    In memory index media source -> provider -> conversations.
+    Changes are applied in version order, a gap in versions triggers a full reload.
+    Versions are taken after the database commit, so changes of two replicas may be numbered
+    in the opposite order, the periodic resync compares the whole table with the configuration
+    to repair that.
+    """
+    def __init__(self, configuration, redis: Redis, resync_interval: float | None = None,
+                 on_new_source: Callable[[str], None] | None = None):
+        self.configuration = configuration
+        self.on_new_source = on_new_source
+        self.redis = redis
+        self.resync_interval = resync_interval or get_settings().routing_resync_interval
+        self.version = 0
+        self.loaded = False
+        self.routes: Dict[str, Dict[str, Set[str]]] = {}
+        self.lock = asyncio.Lock()
+        self.logger = getLogger("RoutingTable")
+
+    async def get_remote_version(self) -> int:
+        return int(await self.redis.get(SUBSCRIPTIONS_VERSION_KEY) or 0)
+
+    async def load(self) -> None:
+        async with self.lock:
+            await self._load()
+
+    async def _load(self, only_changed: bool = False) -> bool:
+        """
+        Replaces routes with the ones from the configuration, returns whether they differed
+        """
+        # version is read first, changes racing with the load are applied again which is harmless
+        version = await self.get_remote_version()
+        routes: Dict[str, Dict[str, Set[str]]] = {}
+        subscriptions = await self.configuration.get_subscriptions()
+        for media_source, conversation in subscriptions:
+            add_route(routes, media_source, conversation)
+        changed = routes != self.routes
+        if only_changed and not changed:
+            self.version = version
+            return False
+        new_sources = routes.keys() - self.routes.keys()
+        self.routes = routes
+        self.version = version
+        # sources found on the initial load are not new
+        if self.on_new_source and self.loaded:
+            for media_source in new_sources:
+                self.on_new_source(media_source)
+        self.loaded = True
+        self.logger.info("Loaded %s subscriptions, version %s", len(subscriptions), version)
+        return changed
+
+    def find_subs(self, source_id: str) -> Dict[str, List[str]]:
+        return {provider: list(convs) for provider, convs in self.routes.get(source_id, {}).items()}
+
+    def get_sources(self) -> List[str]:
+        return list(self.routes.keys())
+
+    def apply(self, change: SubscriptionChange) -> bool:
+        """
+        Returns False if the change can't be applied because some previous changes were missed
+        """
+        if change.version <= self.version:
+            return True
+        if change.version != self.version + 1:
+            return False
+
+        if change.action == "add":
+            is_new = change.media_source not in self.routes
+            add_route(self.routes, change.media_source, change.conversation)
+            if is_new and self.on_new_source:
+                self.on_new_source(change.media_source)
+        elif change.action == "rm":
+            remove_route(self.routes, change.media_source, change.conversation)
+        self.version = change.version
+        return True
+
+    async def on_change(self, change: SubscriptionChange) -> None:
+        async with self.lock:
+            if change.action == "reload":
+                await self._load()
+            elif not self.apply(change):
+                self.logger.warning("Missed subscription changes %s -> %s, reloading",
+                                    self.version, change.version)
+                await self._load()
+
+    async def serve(self) -> None:
+        """
+        Applies change notifications and resyncs with the configuration, runs until cancelled
+        """
+        await asyncio.gather(self.listen(), self.resync())
+
+    async def listen(self) -> None:
+        reconnect = False
+        while True:
+            try:
+                if reconnect:
+                    # changes published while the stream was down are lost
+                    await self.load()
+                pubsub = PubsubRedis(self.redis)
+                async for _, __, message_raw in pubsub.stream_messages(SUBSCRIPTIONS_CHANNEL):
+                    await self.on_change(parse_raw_as(SubscriptionChange, message_raw))
+            except Exception:
+                self.logger.exception("Subscription changes stream failed, reconnecting")
+            reconnect = True
+            await asyncio.sleep(1)
+
+    async def resync(self) -> None:
+        while True:
+            await asyncio.sleep(self.resync_interval)
+            try:
+                async with self.lock:
+                    if await self._load(only_changed=True):
+                        self.logger.warning(
+                            "Subscriptions differed from the configuration, reloaded")
+            except Exception:
+                self.logger.exception("Failed to resync subscriptions")
+
+
+def add_route(routes: Dict[str, Dict[str, Set[str]]], media_source: str, conversation: str) -> None:
+    provider, conversation_id = conversation.split("@")
+    routes.setdefault(media_source, {}).setdefault(provider, set()).add(conversation_id)
+
+
+def remove_route(routes: Dict[str, Dict[str, Set[str]]], media_source: str,
+                 conversation: str) -> None:
+    provider, conversation_id = conversation.split("@")
+    providers = routes.get(media_source, {})
+    providers.get(provider, set()).discard(conversation_id)
+    if not providers.get(provider):
+        providers.pop(provider, None)
+    if not providers:
+        routes.pop(media_source, None)
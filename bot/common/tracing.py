@@ -0,0 +1,114 @@
+import asyncio
+import atexit
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List
+
+from bot.common.metrics import POST_STAGE_LATENCY
+from bot.common.models import Post, PostTrace
+from bot.common.settings import get_settings
+
+
+class SpanExporter:
+    """
+    Appends spans to a JSONL file in OpenTelemetry JSON layout.
+    Spans are batched and written by a single thread so the event loop never waits for the disk.
+    """
+
+    def __init__(self, filename: str, flush_interval: float = 1.0):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.spans: List[dict] = []
+        self.flush_handle: asyncio.TimerHandle | None = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def export(self, span: dict):
+        self.spans.append(span)
+        if self.flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self.flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        self.flush_handle = None
+        spans, self.spans = self.spans, []
+        if spans:
+            self.executor.submit(write_spans, self.filename, spans)
+
+    def close(self):
+        """
+        Waits for the writer thread and writes pending spans, registered to run at exit.
+        Executors are shut down before atexit handlers run,
+        so pending spans are written synchronously.
+        """
+        if self.flush_handle:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.executor.shutdown(wait=True)
+        spans, self.spans = self.spans, []
+        if spans:
+            write_spans(self.filename, spans)
+
+
+def write_spans(filename: str, spans: List[dict]):
+    with open(filename, "a") as f:
+        f.writelines(json.dumps(span) + "\n" for span in spans)
+
+
+@lru_cache
+def get_span_exporter() -> SpanExporter | None:
+    trace_file = get_settings().trace_file
+    if not trace_file:
+        return None
+    exporter = SpanExporter(trace_file)
+    atexit.register(exporter.close)
+    return exporter
+
+
+def record_stage(post: Post, stage: str, start: float | None, end: float, **attributes):
+    if start is None:
+        return
+    # reddit and local clocks differ slightly
+    POST_STAGE_LATENCY.labels(stage).observe(max(end - start, 0))
+
+    exporter = get_span_exporter()
+    if exporter and post.trace:
+        exporter.export({
+            "traceId": post.trace.trace_id,
+            "spanId": os.urandom(8).hex(),
+            "name": stage,
+            "startTimeUnixNano": int(start * 1e9),
+            "endTimeUnixNano": int(end * 1e9),
+            "attributes": {"source_id": post.source_id, **attributes},
+        })
+
+
+def start_trace(post: Post, created: float | None):
+    """
+    Called by the scrapper, created is the time the post appeared at the source
+    """
+    scraped = time.time()
+    post.trace = PostTrace(trace_id=os.urandom(16).hex(), created=created, scraped=scraped)
+    record_stage(post, "scrape", created, scraped)
+
+
+def mark_routed(post: Post):
+    if post.trace:
+        post.trace.routed = now = time.time()
+        record_stage(post, "route", post.trace.scraped, now)
+
+
+def mark_media_ready(post: Post):
+    # recorded once, media of a post is prepared again only when delivery to the first chat failed
+    if post.trace and post.trace.media_ready is None:
+        post.trace.media_ready = now = time.time()
+        record_stage(post, "media", post.trace.routed, now)
+
+
+def mark_delivered(post: Post, chat_id: str):
+    if post.trace:
+        now = time.time()
+        record_stage(post, "deliver", post.trace.media_ready, now, chat_id=chat_id)
+        record_stage(post, "total", post.trace.created, now, chat_id=chat_id)
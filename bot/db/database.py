@@ -1,9 +1,21 @@
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
 from bot.common.settings import get_settings
 
-engine = create_async_engine(get_settings().db, pool_pre_ping=True, pool_recycle=10*60)
+
+def get_db_url():
+    settings = get_settings()
+    url = make_url(settings.db)
+    if url.drivername == "postgresql+asyncpg":
+        # asyncpg keeps prepared statements per connection, hot queries are parsed and planned once
+        cache_size = str(settings.db_prepared_statement_cache_size)
+        url = url.update_query_dict({"prepared_statement_cache_size": cache_size})
+    return url
+
+
+engine = create_async_engine(get_db_url(), pool_pre_ping=True, pool_recycle=10*60)
 
 async_session = sessionmaker(
     engine, expire_on_commit=False, class_=AsyncSession
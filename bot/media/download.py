@@ -0,0 +1,114 @@
+import asyncio
+import os
+from logging import getLogger
+from typing import BinaryIO, List, Tuple
+
+import aiohttp
+
+logger = getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class RangeNotSupported(DownloadError):
+    pass
+
+
+async def get_size(session: aiohttp.ClientSession, url: str) -> int | None:
+    async with session.head(url, allow_redirects=True) as head:
+        if head.status > 204:
+            raise DownloadError(f"Unexpected status code {head.status} for {url}")
+        if head.headers.get("Accept-Ranges") != "bytes":
+            return None
+        return head.content_length
+
+
+def split_ranges(size: int, parts: int) -> List[Tuple[int, int]]:
+    """
+    Inclusive byte ranges covering size bytes
+    """
+    part_size = max(-(-size // parts), 1)
+    return [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+
+async def download_range(session: aiohttp.ClientSession, url: str, filename: str,
+                         start: int, end: int | None, attempts: int) -> None:
+    """
+    Writes bytes start..end of url at the same offset of the file,
+    a failed attempt resumes where it stopped
+    """
+    position = start
+    for attempt in range(1, attempts + 1):
+        try:
+            headers = {"Range": f"bytes={position}-{'' if end is None else end}"}
+            async with session.get(url, headers=headers) as resp:
+                if resp.status == 200 and (position > 0 or end is not None):
+                    raise RangeNotSupported(f"{url} does not support ranges")
+                if resp.status not in (200, 206):
+                    raise DownloadError(f"Unexpected status code {resp.status} for {url}")
+                # the disk is written from a thread so a slow disk does not block the event loop
+                f = await asyncio.to_thread(open_for_update, filename)
+                try:
+                    f.seek(position)
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        await asyncio.to_thread(f.write, chunk)
+                        position += len(chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+            if end is None or position > end:
+                return
+            raise DownloadError(f"Got truncated range {start}-{end} of {url} at {position}")
+        except (aiohttp.ClientError, asyncio.TimeoutError, DownloadError) as ex:
+            if isinstance(ex, RangeNotSupported) or attempt == attempts:
+                raise DownloadError(f"Failed to download {url}: {ex}") from ex
+            logger.warning("Download of %s failed at %s, attempt %s: %s",
+                           url, position, attempt, ex)
+            await asyncio.sleep(attempt)
+
+
+async def download(session: aiohttp.ClientSession, url: str, filename: str, *,
+                   size: int | None = None, parts: int = 4, attempts: int = 3) -> int:
+    """
+    Downloads url to filename using up to `parts` concurrent range requests,
+    returns size of the file
+    """
+    try:
+        if size is None:
+            size = await get_size(session, url)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+        raise DownloadError(f"Failed to get size of {url}") from ex
+
+    await asyncio.to_thread(create_file, filename, size)
+
+    if size and parts > 1:
+        tasks = [asyncio.create_task(download_range(session, url, filename, start, end, attempts))
+                 for start, end in split_ranges(size, parts)]
+        try:
+            await asyncio.gather(*tasks)
+            return size
+        except DownloadError as ex:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if not isinstance(ex.__cause__, RangeNotSupported):
+                raise
+            logger.warning("Ranges are not supported by %s, downloading sequentially", url)
+            await asyncio.to_thread(create_file, filename, None)
+
+    await download_range(session, url, filename, 0, None, attempts)
+    return os.path.getsize(filename)
+
+
+def open_for_update(filename: str) -> BinaryIO:
+    return open(filename, "r+b")
+
+
+def create_file(filename: str, size: int | None) -> None:
+    # ranges are written at their offsets into a file of the final size
+    with open(filename, "wb") as f:
+        if size:
+            f.truncate(size)
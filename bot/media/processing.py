@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+
+import aiohttp
+
+from bot.common.settings import get_settings
+from bot.media.download import download, DownloadError
+
+logger = getLogger(__name__)
+
+
+class MediaProcessingError(Exception):
+    pass
+
+
+def shrink_image(data: bytes, max_side: int, max_bytes: int) -> bytes:
+    """
+    Downscales image to max_side and recompresses it as jpeg until it fits max_bytes.
+    Raises MediaProcessingError if it does not fit. Runs in a worker process.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.seek(0)  # first frame of animated images
+        image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+        for quality in (90, 80, 70, 60, 50):
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+            if output.tell() <= max_bytes:
+                break
+            # halve the area for the next attempt
+            if quality <= 70:
+                image.thumbnail((image.width * 7 // 10, image.height * 7 // 10))
+        else:
+            raise MediaProcessingError(f"Could not fit the image into {max_bytes} bytes")
+        return output.getvalue()
+
+
+class MediaProcessor:
+    """
+    Downloads media telegram could not fetch itself and makes it acceptable: images are downscaled
+    and recompressed in a process pool, animations are converted to mp4 with ffmpeg.
+    Results are cached on disk by source url.
+    """
+    def __init__(self, session: aiohttp.ClientSession, pool: ProcessPoolExecutor | None = None):
+        settings = get_settings()
+        self.session = session
+        self.pool = pool or ProcessPoolExecutor(max_workers=settings.media_workers)
+        self.cache_dir = settings.media_cache_dir \
+            or os.path.join(tempfile.gettempdir(), "web2tg_media_cache")
+        self.cache_size = settings.media_cache_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def cache_path(self, kind: str, url: str) -> str:
+        return os.path.join(self.cache_dir, kind + "_" + hashlib.sha1(url.encode()).hexdigest())
+
+    async def cached(self, kind: str, url: str) -> bytes | None:
+        path = self.cache_path(kind, url)
+        try:
+            return await asyncio.to_thread(read_file, path)
+        except FileNotFoundError:
+            return None
+
+    async def store(self, kind: str, url: str, data: bytes) -> None:
+        await asyncio.to_thread(write_file, self.cache_path(kind, url), data)
+        await asyncio.to_thread(trim_cache, self.cache_dir, self.cache_size)
+
+    async def fetch(self, url: str, filename: str) -> None:
+        settings = get_settings()
+        try:
+            await download(self.session, url, filename,
+                           parts=settings.download_parts, attempts=settings.download_attempts)
+        except DownloadError as ex:
+            raise MediaProcessingError(f"Could not download {url}") from ex
+
+    async def photo(self, url: str) -> bytes:
+        if cached := await self.cached("photo", url):
+            return cached
+
+        settings = get_settings()
+        with tempfile.TemporaryDirectory(dir=settings.media_dir) as d:
+            filename = os.path.join(d, "source")
+            await self.fetch(url, filename)
+            source = await asyncio.to_thread(read_file, filename)
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(
+                self.pool, shrink_image, source, settings.max_photo_side, settings.max_photo_size)
+        except Exception as ex:
+            raise MediaProcessingError(f"Could not recompress {url}") from ex
+        logger.debug("Recompressed %s from %s to %s bytes", url, len(source), len(data))
+
+        await self.store("photo", url, data)
+        return data
+
+    async def video(self, url: str) -> bytes:
+        """
+        Converts gif or any other animation to mp4
+        """
+        if cached := await self.cached("video", url):
+            return cached
+
+        settings = get_settings()
+        with tempfile.TemporaryDirectory(dir=settings.media_dir) as d:
+            source = os.path.join(d, "source")
+            output = os.path.join(d, "output.mp4")
+            await self.fetch(url, source)
+            # even frame dimensions are required by yuv420p
+            proc = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-i", source, "-movflags", "faststart", "-pix_fmt", "yuv420p",
+                "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2", "-an", "-y", output)
+            try:
+                rc = await asyncio.wait_for(proc.wait(), settings.ffmpeg_timeout)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                raise MediaProcessingError(f"ffmpeg timeout converting {url}")
+            if rc != 0:
+                raise MediaProcessingError(f"Non zero rc code for ffmpeg {rc}")
+            if os.path.getsize(output) > settings.max_upload_size:
+                raise MediaProcessingError(f"Converted {url} is too big")
+            data = await asyncio.to_thread(read_file, output)
+
+        await self.store("video", url, data)
+        return data
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write_file(path: str, data: bytes) -> None:
+    # rename is atomic, readers never see a partially written file
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def trim_cache(cache_dir: str, max_files: int) -> None:
+    entries = [entry for entry in os.scandir(cache_dir) if entry.is_file()]
+    if len(entries) <= max_files:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - max_files]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
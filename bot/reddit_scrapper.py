@@ -1,71 +1,109 @@
 import asyncio
-import logging.config
 from logging import getLogger
-from typing import List
 
 from bot.common.cache import get_new_cache
 from bot.common.configuration import get_configuration
+from bot.common.logs import setup_logging
+from bot.common.metrics import SCRAPE_NEW_POSTS
 from bot.common.pubsub import get_new_pubsub
 from bot.common.redis import get_new_redis
+from bot.common.routing import RoutingTable
+from bot.common.tracing import start_trace
 from bot.scrap.reddit import RedditValidationError, RedditPosts, RedditError, RedditThrottleError, reddit_post_to_message, RedditNotFoundError
 from bot.scrap.reddit_models import SubredditListing, BadRedditUrlException
+from bot.startup import run_service
 
 logger = getLogger()
 
 
-async def main():
-    redis = get_new_redis()
-    pubsub = get_new_pubsub()
-    cache = get_new_cache()
-    configuration = get_configuration()
+class RedditScrapper:
+    default_pause = 10.0
 
-    rd_posts = RedditPosts()
+    def __init__(self):
+        self.redis = get_new_redis()
+        self.pubsub = get_new_pubsub()
+        self.cache = get_new_cache()
+        self.configuration = get_configuration()
+        # sources are kept in memory and updated by subscription change notifications
+        self.routing = RoutingTable(self.configuration, self.redis,
+                                    on_new_source=self.schedule_fetch)
+        self.rd_posts = RedditPosts()
 
-    default_pause = 10.0
-    pause = default_pause
+        self.pause = self.default_pause
+        self.urgent: asyncio.Queue[str] = asyncio.Queue()
+
+    def schedule_fetch(self, full_id: str):
+        logger.info("New source %s, scheduling a fetch", full_id)
+        self.urgent.put_nowait(full_id)
+
+    async def serve(self):
+        await self.routing.load()
+        await asyncio.gather(self.routing.serve(), self.scrape())
+
+    async def scrape(self):
+        while True:
+            await self.fetch_urgent()
+            for full_id in self.routing.get_sources():
+                await self.fetch_urgent()
+                if full_id in self.routing.routes:
+                    await self.fetch(full_id)
+            await asyncio.sleep(1)
+
+    async def fetch_urgent(self):
+        while not self.urgent.empty():
+            await self.fetch(self.urgent.get_nowait())
+
+    async def fetch(self, full_id: str):
+        try:
+            sub_type, sub_name = full_id.split("@")
+            if sub_type != "reddit":
+                return
+            sub = SubredditListing.from_str_tuple(sub_name)
+        except BadRedditUrlException:
+            logger.warning("Not a reddit listing %s", full_id)
+            return
+        cache_name = f"cache_{sub_name}"
+        first_time = not await self.cache.has_cache(cache_name)
 
-    while True:
-        watch_subs: List[str] = await configuration.get_sources()
-        for full_id in watch_subs:
+        posts = []
+        while True:
+            await asyncio.sleep(self.pause)
             try:
-                sub_type, sub_name = full_id.split("@")
-                if sub_type != "reddit":
-                    continue
-                sub = SubredditListing.from_str_tuple(sub_name)
-            except BadRedditUrlException:
-                logger.warning("Not a reddit listing %s", full_id)
+                posts = await self.rd_posts.get_posts(sub)
+            except RedditNotFoundError:
+                logger.warning("Could not found listing, ignoring...")
+            except RedditValidationError:
+                logger.error("Validation failed")
+            except RedditThrottleError:
+                self.pause += 10 if self.pause < 300 else 0
+                logger.warning("Too many requests %s, will wait for %s", sub_name, self.pause)
                 continue
-            cache_name = f"cache_{sub_name}"
-            first_time = not await cache.has_cache(cache_name)
-
-            posts = []
-            while True:
-                await asyncio.sleep(pause)
-                try:
-                    posts = await rd_posts.get_posts(sub)
-                except RedditNotFoundError:
-                    logger.warning("Could not found listing, ignoring...")
-                except RedditValidationError:
-                    logger.error("Validation failed")
-                except RedditThrottleError:
-                    pause += 10 if pause < 300 else 0
-                    logger.warning("Too many requests %s, will wait for %s", sub_name, pause)
-                    continue
-                except RedditError:
-                    logger.exception("Failed to get posts %s", sub_name)
-                break
-
-            pause = default_pause
-
-            for reddit_post in posts:
-                if await cache.cache_item(cache_name, reddit_post.data.id) and not first_time:
-                    post = reddit_post_to_message(full_id, reddit_post.data)
-                    logger.debug("Source post is: %s", reddit_post.data)
-                    logger.debug("Going to send new post: %s", post)
-                    await pubsub.publish("media",
-                                         post.json(exclude_unset=True, exclude_defaults=True, exclude_none=True))
-        await asyncio.sleep(1)
+            except RedditError:
+                logger.exception("Failed to get posts %s", sub_name)
+            break
+
+        self.pause = self.default_pause
+
+        new_posts = 0
+        for reddit_post in posts:
+            if await self.cache.cache_item(cache_name, reddit_post.data.id) and not first_time:
+                new_posts += 1
+                post = reddit_post_to_message(full_id, reddit_post.data)
+                start_trace(post, reddit_post.data.created_utc)
+                logger.debug("Going to send new post %s %s", reddit_post.data.id, post.url)
+                await self.pubsub.publish("media", post.json(exclude_unset=True,
+                                                             exclude_defaults=True,
+                                                             exclude_none=True))
+        SCRAPE_NEW_POSTS.observe(new_posts)
+
+
+# services waited for before main starts
+DEPENDENCIES = ("db", "rabbitmq", "redis")
+
+
+async def main():
+    await RedditScrapper().serve()
 
 if __name__ == "__main__":
-    logging.config.fileConfig("logger.ini")
-    asyncio.run(main())
+    setup_logging()
+    run_service(main, DEPENDENCIES)
@@ -0,0 +1,35 @@
+import argparse
+import asyncio
+
+from pydantic import parse_raw_as
+
+from bot.common.models import OutboundMessage
+from bot.common.pubsub import get_new_pubsub
+from bot.common.redis import get_new_redis
+from bot.common.retry import pop_dead_letters, DEAD_LETTER_KEY
+
+
+async def main(count: int, dry_run: bool):
+    redis = get_new_redis()
+    if dry_run:
+        for item in await redis.lrange(DEAD_LETTER_KEY, 0, count - 1):
+            print(item)
+        return
+
+    pubsub = get_new_pubsub()
+    for item in await pop_dead_letters(redis, count):
+        message = item["message"]
+        if item["channel"].startswith("telegram_"):
+            # start counting attempts from scratch
+            message = parse_raw_as(OutboundMessage, message).copy(update={"attempt": 0}).json()
+        print(f"Replaying message to {item['channel']}, "
+              f"failed {item['attempt']} times: {item['reason']}")
+        await pubsub.publish(item["channel"], message)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay dead lettered messages")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true", help="only print messages")
+    args = parser.parse_args()
+    asyncio.run(main(args.count, args.dry_run))
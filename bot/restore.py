@@ -1,24 +1,54 @@
+import argparse
 import asyncio
 import json
-import os
 import sys
+from typing import List, Tuple
 
-from bot.common.crud import find_or_add_media_source, add_conversation_for_media_source
+from bot.backup import key_to_source
+from bot.common.crud import add_subscriptions, get_subscriptions
+from bot.common.redis import get_new_redis
+from bot.common.routing import SubscriptionNotifier
 from bot.db.database import async_session
-from bot.scrap.reddit_models import SubredditListing
 
 
-async def main(file):
+def read_subscriptions(file) -> List[Tuple[str, str]]:
     data = json.load(file)
+    result: List[Tuple[str, str]] = []
+    for key, convs in data.items():
+        source = key_to_source(key)
+        result.extend((source, conv) for conv in convs)
+    return result
+
+
+async def main(file, batch_size: int, dry_run: bool):
+    subscriptions = list(dict.fromkeys(read_subscriptions(file)))
+    print(f"Read {len(subscriptions)} subscriptions", file=sys.stderr)
+
     async with async_session() as db:
-        for media_source, convs in data.items():
-            print(f"Adding source {media_source}, convs: {convs}")
-            # todo: non reddit stuff
-            listing = SubredditListing.from_url(media_source)
-            src = await find_or_add_media_source(db, "reddit@" + listing.to_str_tuple())
+        if dry_run:
+            existing = set(await get_subscriptions(db))
+            missing = [item for item in subscriptions if item not in existing]
+            for source, conv in missing:
+                print(f"+ {source} {conv}")
+            print(f"{len(missing)} to add, {len(subscriptions) - len(missing)} already exist",
+                  file=sys.stderr)
+            return
+
+        added = 0
+        for index in range(0, len(subscriptions), batch_size):
+            added += await add_subscriptions(db, subscriptions[index:index + batch_size])
+            processed = min(index + batch_size, len(subscriptions))
+            print(f"Processed {processed}/{len(subscriptions)}", file=sys.stderr)
+        await db.commit()
+    print(f"Added {added} subscriptions", file=sys.stderr)
 
-            for conv in convs:
-                await add_conversation_for_media_source(db, conv, src)
+    # running services reload their routing tables instead of waiting for the next resync
+    await SubscriptionNotifier(get_new_redis()).notify_reload()
 
 if __name__ == "__main__":
-    asyncio.run(main(sys.stdin))
+    parser = argparse.ArgumentParser(
+        description="Restore subscriptions from backup read from stdin")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="only print subscriptions to add")
+    args = parser.parse_args()
+    asyncio.run(main(sys.stdin, args.batch_size, args.dry_run))
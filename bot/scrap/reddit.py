@@ -1,13 +1,16 @@
 import asyncio
+import hashlib
 import re
 from logging import getLogger
-from typing import List
+from typing import Dict, List, Tuple
 import urllib.parse
 import aiohttp
 import pydantic
 
-from bot.common.models import Post, MediaItem
-from bot.scrap.reddit_models import RedditReply, SubredditListing, Item, RedditPost, PreviewImage, RedditVideoPreview
+from bot.common.metrics import SCRAPE_LATENCY, SCRAPE_THROTTLED
+from bot.common.models import Post, MediaItem, MediaSize
+from bot.scrap.reddit_models import RedditReply, SubredditListing, Item, RedditPost, PreviewImage, \
+    RedditVideoPreview, ImageMetadata
 
 logger = getLogger()
 
@@ -37,19 +40,22 @@ class RedditPosts:
         url = sub.to_url(json=True)
 
         # todo: more exceptions
+        listing = sub.to_str_tuple()
         try:
-            async with self.session.get(url) as req:
-                self.logger.debug("Got reply for %s: %s %s %s",
-                                  sub.to_str_tuple(), req.status, req.content_type, req.content_length)
-                if not req.ok:
-                    if req.status == 429:
-                        raise RedditThrottleError("Too many requests")
-                    elif req.status == 404:
-                        raise RedditNotFoundError("Listing not found")
-                    else:
-                        raise RedditError(f"Got error {req.status} from {url}")
-
-                data = await req.text()
+            with SCRAPE_LATENCY.labels(listing).time():
+                async with self.session.get(url) as req:
+                    self.logger.debug("Got reply for %s: %s %s %s",
+                                      listing, req.status, req.content_type, req.content_length)
+                    if not req.ok:
+                        if req.status == 429:
+                            SCRAPE_THROTTLED.labels(listing).inc()
+                            raise RedditThrottleError("Too many requests")
+                        elif req.status == 404:
+                            raise RedditNotFoundError("Listing not found")
+                        else:
+                            raise RedditError(f"Got error {req.status} from {url}")
+
+                    data = await req.text()
 
         except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
             raise RedditError(f"Client error {str(ex)}") from ex
@@ -58,9 +64,10 @@ class RedditPosts:
             reply: RedditReply = pydantic.parse_raw_as(RedditReply, data)
             return reply.data.children if reply.data.children else []
         except pydantic.ValidationError as ex:
-            logger.error(f"Data were {data}")
-            logger.error(ex.errors())
-            logger.error(ex.json())
+            # the listing can be megabytes, only its size, hash and the first errors are logged
+            errors = ex.errors()
+            logger.error("Could not parse %s chars from %s, sha1 %s, %s errors: %s", len(data), url,
+                         hashlib.sha1(data.encode()).hexdigest(), len(errors), errors[:5])
             raise RedditValidationError("Could not parse reddit output") from ex
 
 
@@ -68,6 +75,10 @@ def fix_url(url: str) -> str:
     return url.replace("&amp;", "&")
 
 
+def metadata_url(metadata: ImageMetadata) -> str:
+    return fix_url(metadata.u or metadata.mp4 or "")
+
+
 def reddit_post_to_message(source_id: str, reddit_post: RedditPost) -> Post:
     images = []
     videos = []
@@ -77,23 +88,28 @@ def reddit_post_to_message(source_id: str, reddit_post: RedditPost) -> Post:
 
     if reddit_post.media_metadata:
         # gallery post
-        media_items = {}
+        media_items: Dict[str, Tuple[str, List[ImageMetadata], ImageMetadata]] = {}
         for media_id, media_metadata in reddit_post.media_metadata.items():
             if media_metadata.s:
-                # Image|AnimatedImage, url
-                media_items[media_id] = media_metadata.e, media_metadata.s.u or media_metadata.s.mp4
+                # Image|AnimatedImage, previews, source
+                media_items[media_id] = media_metadata.e, media_metadata.p or [], media_metadata.s
 
         if reddit_post.gallery_data and reddit_post.gallery_data.items:
             for item in reddit_post.gallery_data.items:
-                media_item_type, url = media_items[item.media_id]
-                item_to_add = MediaItem(
-                        urls=[fix_url(url)],
-                        caption=item.caption
-                    )
+                media_item_type, previews, source = media_items[item.media_id]
                 if media_item_type == "Image":
-                    images.append(item_to_add)
+                    variants = [variant for variant in previews if variant.u] + [source]
+                    images.append(MediaItem(
+                        urls=[metadata_url(variant) for variant in variants],
+                        sizes=[MediaSize(width=variant.x, height=variant.y)
+                               for variant in variants],
+                        caption=item.caption
+                    ))
                 elif media_item_type == "AnimatedImage":
-                    videos.append(item_to_add)
+                    videos.append(MediaItem(
+                        urls=[metadata_url(source)],
+                        caption=item.caption
+                    ))
 
     elif (reddit_post.media and reddit_post.media.reddit_video) \
             or (reddit_post.preview and reddit_post.preview.reddit_video_preview):
@@ -145,7 +161,11 @@ def reddit_post_to_message(source_id: str, reddit_post: RedditPost) -> Post:
                     videos.append(MediaItem(urls=this_video))
             else:
                 if post_image.source and post_image.source.url:
-                    images.append(MediaItem(urls=[fix_url(post_image.source.url)]))
+                    image_variants = (post_image.resolutions or []) + [post_image.source]
+                    images.append(MediaItem(
+                        urls=[fix_url(variant.url) for variant in image_variants],
+                        sizes=[MediaSize(width=variant.width, height=variant.height)
+                               for variant in image_variants]))
 
     return Post(source_id=source_id,
                 source_text=reddit_post.subreddit_name_prefixed or reddit_post.subreddit,
@@ -1,49 +1,117 @@
-import asyncio
+"""
+Readiness of the services a process depends on.
+Services wait for their own dependencies in-process, so connections opened by the probes are kept
+and used by the service: the rabbitmq connection is shared by all pubsub instances and the database
+pool by all sessions.
 
-import aio_pika
-import aioredis
+python -m bot.startup [db|rabbitmq|redis ...]   # waits for the listed dependencies, all by default
+"""
+import asyncio
+import os
+import sys
+import time
+from logging import getLogger
+from typing import Awaitable, Callable, Iterable, Tuple
 
+from bot.common.logs import setup_logging
+from bot.common.metrics import STARTUP_SECONDS, start_metrics_server
+from bot.common.pubsub import get_rabbit_connection
+from bot.common.redis import get_new_redis
 from bot.common.settings import get_settings
-from bot.db.database import async_session
+
+logger = getLogger("startup")
+
+ALL_DEPENDENCIES = ("db", "rabbitmq", "redis")
 
 
 async def wait_db():
+    # sqlalchemy is imported only by services using the database
+    from bot.db.database import async_session
+
     while True:
         try:
             async with async_session() as db:
                 await db.execute("select * from alembic_version")
-            print("DB is ok")
+            logger.info("DB is ok")
             break
         except Exception as ex:
-            print(f"DB is down: {ex}")
+            logger.warning(f"DB is down: {ex}")
         await asyncio.sleep(1)
 
 
 async def wait_rmq():
     while True:
         try:
-            await aio_pika.connect_robust(get_settings().rabbitmq)
-            print("RMQ is ok")
+            await get_rabbit_connection()
+            logger.info("RMQ is ok")
             break
         except Exception as ex:
-            print(f"RMQ is down: {ex}")
+            logger.warning(f"RMQ is down: {ex}")
         await asyncio.sleep(1)
 
 
 async def wait_redis():
-    c = aioredis.from_url(get_settings().redis)
-    while True:
+    redis = get_new_redis()
+    try:
+        while True:
+            try:
+                await redis.ping()
+                logger.info("Redis is ok")
+                break
+            except Exception as ex:
+                logger.warning(f"Redis is down: {ex}")
+            await asyncio.sleep(1)
+    finally:
+        await redis.close()
+
+
+async def wait_ready(dependencies: Iterable[str]):
+    waiters = {"db": wait_db, "rabbitmq": wait_rmq, "redis": wait_redis}
+    await asyncio.gather(*(waiters[dependency]() for dependency in dependencies))
+
+
+def process_started() -> float:
+    """
+    Unix time the container entrypoint started the process, it exports STARTUP_TIME
+    """
+    try:
+        return float(os.environ["STARTUP_TIME"])
+    except (KeyError, ValueError):
+        return time.time()
+
+
+def run_service(main: Callable[[], Awaitable], dependencies: Tuple[str, ...]):
+    """
+    Entry point of the services: waits for dependencies, starts metrics and diagnostics
+    and runs main, optionally on uvloop
+    """
+    started = process_started()
+    imported = time.time()
+    if get_settings().uvloop:
         try:
-            await c.ping()
-            print("Redis is ok")
-            break
-        except Exception as ex:
-            print(f"Redis is down: {ex}")
-        await asyncio.sleep(1)
+            import uvloop
+            uvloop.install()
+        except ImportError:
+            logger.warning("uvloop is not installed, using the default event loop")
+
+    async def start():
+        await wait_ready(dependencies)
+        ready = time.time()
+        STARTUP_SECONDS.labels("imports").set(imported - started)
+        STARTUP_SECONDS.labels("dependencies").set(ready - imported)
+        logger.info("Ready in %.2fs, imports %.2fs, waiting for %s %.2fs",
+                    ready - started, imported - started, ", ".join(dependencies), ready - imported)
+
+        start_metrics_server()
+        if get_settings().diagnostics:
+            # profiler and admin server are imported only when enabled
+            from bot.common.diagnostics import start_diagnostics
+            await start_diagnostics()
+        await main()
 
+    asyncio.run(start())
 
-async def main():
-    await asyncio.gather(wait_db(), wait_rmq(), wait_redis())
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    setup_logging()
+    asyncio.run(wait_ready(sys.argv[1:] or ALL_DEPENDENCIES))
@@ -1,14 +1,16 @@
 import asyncio
 from logging import getLogger
-from typing import List
+from json import dumps
+from typing import List, Type, Any, Dict
 
 import aiohttp
-from pydantic import parse_raw_as
 
+from bot.common.metrics import TELEGRAM_LATENCY, TELEGRAM_RETRIES, TELEGRAM_FLOOD_WAITS, \
+    TELEGRAM_UPLOADED_BYTES
 from bot.common.settings import get_settings
 from bot.telegram.telegram_models import TelegramSendPhotoRequest, TelegramSendVideoRequest, TelegramSendMessageRequest, \
-    TelegramSendMediaGroupRequest, TelegramCopyMessageRequest, TelegramRequest, TelegramReply, InputMedia, Message, \
-    MessageId, Chat
+    TelegramSendMediaGroupRequest, TelegramCopyMessageRequest, TelegramRequest, TelegramReply, \
+    InputMedia, MessageId, Chat, SetWebhook, DeleteWebhook, ShortMessage
 
 
 class TelegramClientException(Exception):
@@ -27,17 +29,57 @@ class TelegramClientSizeException(TelegramClientBadRequest):
     pass
 
 
+class TelegramClientTransientError(TelegramClientException):
+    pass
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 1/rate seconds apart
+    """
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
 class TelegramClient:
-    def __init__(self, token: str):
+    def __init__(self, token: str, session: aiohttp.ClientSession | None = None):
         self.token = token
-        self.session = aiohttp.ClientSession()
+        # bots served by one process share the connection pool but keep their own rate limits
+        self.session = session or aiohttp.ClientSession()
+        self.rate_limiter = RateLimiter(get_settings().telegram_rate_limit)
         self.logger = getLogger()
 
-    async def _send_request(self, request_method: str, request: TelegramRequest | TelegramSendPhotoRequest | TelegramSendVideoRequest | TelegramSendMessageRequest | TelegramSendMediaGroupRequest | TelegramCopyMessageRequest):
+    async def _send_request(self, request_method: str,
+                            request: TelegramRequest | TelegramSendPhotoRequest
+                            | TelegramSendVideoRequest | TelegramSendMessageRequest
+                            | TelegramSendMediaGroupRequest | TelegramCopyMessageRequest
+                            | SetWebhook | DeleteWebhook,
+                            result_type: Type | Any, files: Dict[str, bytes] | None = None):
         data: aiohttp.FormData | None = None
-        json: TelegramRequest | None = None
+        json: TelegramRequest | SetWebhook | DeleteWebhook | None = None
+        uploaded = 0
 
-        if (type(request) is TelegramSendVideoRequest and type(request.video) is bytes) or \
+        if type(request) is TelegramSendMediaGroupRequest and files:
+            # media refers to uploaded files as attach://<name>
+            data = aiohttp.FormData()
+            data.add_field("chat_id", str(request.chat_id))
+            data.add_field("media", dumps([item.dict(exclude_none=True) for item in request.media]))
+            for name, content in files.items():
+                data.add_field(name, content)
+                uploaded += len(content)
+
+        elif (type(request) is TelegramSendVideoRequest and type(request.video) is bytes) or \
            (type(request) is TelegramSendPhotoRequest and type(request.photo) is bytes):
             data = aiohttp.FormData()
             data.add_field("chat_id", str(request.chat_id))
@@ -48,20 +90,29 @@ class TelegramClient:
 
             if type(request) is TelegramSendVideoRequest and request.video:
                 data.add_field("video", request.video)
+                uploaded += len(request.video)
             if type(request) is TelegramSendPhotoRequest and request.photo:
                 data.add_field("photo", request.photo)
+                uploaded += len(request.photo)
 
         else:
             json = request
 
-        while True:
+        attempts = get_settings().telegram_request_attempts
+        for attempt in range(1, attempts + 1):
             try:
+                await self.rate_limiter.wait()
                 self.logger.debug("Going to %s", request_method)
-                async with self.session.post(get_settings().BOT_URL + self.token + "/" + request_method,
-                                             data=data, json=json.dict() if json else None) as req:
+                with TELEGRAM_LATENCY.labels(request_method).time():
+                    url = get_settings().BOT_URL + self.token + "/" + request_method
+                    body = json.dict(exclude_none=True) if json else None
+                    req = await self.session.post(url, data=data, json=body)
+                async with req:
                     self.logger.debug("Got %s %s %s", req.status, req.content_type, req.content_length)
                     if not req.ok:
                         text = await req.text()
+                        if req.status == 429:
+                            TELEGRAM_FLOOD_WAITS.labels(request_method).inc()
                         if req.status == 413:
                             self.logger.error("Request too big!")
                             raise TelegramClientSizeException()
@@ -74,51 +125,77 @@ class TelegramClient:
                         else:
                             raise TelegramClientException(f"Unexpected status {req.status} {text}")
 
-                    reply: TelegramReply = parse_raw_as(TelegramReply, await req.text())
+                    # the reply is decoded straight into the method result type
+                    reply_type = TelegramReply[result_type]  # type: ignore[valid-type]
+                    reply: TelegramReply = reply_type.parse_raw(await req.read())
                     if not reply.ok:
 
                         raise TelegramClientException(f"Reply was not ok: {reply.error_code}, {reply.description}")
+                    TELEGRAM_UPLOADED_BYTES.labels(request_method).inc(uploaded)
                     return reply.result
 
-            except aiohttp.ClientError:
-                self.logger.exception("Got unexpected client error")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.logger.exception("Got unexpected client error, attempt %s of %s",
+                                      attempt, attempts)
+                if attempt < attempts:
+                    TELEGRAM_RETRIES.labels(request_method).inc()
+
+            if attempt < attempts:
+                await asyncio.sleep(attempt)
 
-            await asyncio.sleep(1)
+        raise TelegramClientTransientError(f"{request_method} failed after {attempts} attempts")
 
-    async def send_message(self, chat_id: str | int, text: str, parse_mode: str = "HTML") -> Message:
+    async def send_message(self, chat_id: str | int, text: str,
+                           parse_mode: str = "HTML") -> ShortMessage:
         req = TelegramSendMessageRequest(chat_id=chat_id,
                                          text=text,
                                          parse_mode=parse_mode)
 
-        return await self._send_request("sendMessage", req)
+        return await self._send_request("sendMessage", req, ShortMessage)
 
-    async def send_photo(self, chat_id: str | int, *, caption: str | None = None, parse_mode: str | None = "HTML",
-                         photo_url: str | None = None, photo_bytes: bytes | None = None):
+    async def send_photo(self, chat_id: str | int, *, caption: str | None = None,
+                         parse_mode: str | None = "HTML", photo_url: str | None = None,
+                         photo_bytes: bytes | None = None) -> ShortMessage:
         req = TelegramSendPhotoRequest(chat_id=chat_id,
                                        photo=photo_url or photo_bytes,
                                        caption=caption,
                                        parse_mode=parse_mode)
-        return await self._send_request("sendPhoto", req)
+        return await self._send_request("sendPhoto", req, ShortMessage)
 
-    async def send_video(self, chat_id: str | int, *, caption: str | None = None, parse_mode: str | None = "HTML",
-                         video_url: str | None = None, video_bytes: bytes | None = None):
+    async def send_video(self, chat_id: str | int, *, caption: str | None = None,
+                         parse_mode: str | None = "HTML", video_url: str | None = None,
+                         video_bytes: bytes | None = None) -> ShortMessage:
         req = TelegramSendVideoRequest(chat_id=chat_id,
                                        video=video_url or video_bytes,
                                        caption=caption,
                                        parse_mode=parse_mode)
-        return await self._send_request("sendVideo", req)
+        return await self._send_request("sendVideo", req, ShortMessage)
 
     async def copy_message(self, chat_id: str | int, from_chat_id: str | int, message_id: int) -> MessageId:
         req = TelegramCopyMessageRequest(chat_id=chat_id,
                                          from_chat_id=from_chat_id,
                                          message_id=message_id)
-        return await self._send_request("copyMessage", req)
+        return await self._send_request("copyMessage", req, MessageId)
 
-    async def send_media_group(self, chat_id: str | int, media: List[InputMedia]) -> List[Message]:
+    async def send_media_group(self, chat_id: str | int, media: List[InputMedia],
+                               files: Dict[str, bytes] | None = None) -> List[ShortMessage]:
         req = TelegramSendMediaGroupRequest(chat_id=chat_id,
                                             media=media)
-        return await self._send_request("sendMediaGroup", req)
+        return await self._send_request("sendMediaGroup", req, List[ShortMessage], files)
 
     async def get_chat(self, chat_id: str | int) -> Chat:
         req = TelegramRequest(chat_id=chat_id)
-        return await self._send_request("getChat", req)
+        return await self._send_request("getChat", req, Chat)
+
+    async def set_webhook(self, url: str, *, secret_token: str | None = None,
+                          max_connections: int | None = None,
+                          allowed_updates: List[str] | None = None) -> bool:
+        req = SetWebhook(url=url,
+                         secret_token=secret_token,
+                         max_connections=max_connections,
+                         allowed_updates=allowed_updates)
+        return await self._send_request("setWebhook", req, bool)
+
+    async def delete_webhook(self, drop_pending_updates: bool = False) -> bool:
+        req = DeleteWebhook(drop_pending_updates=drop_pending_updates)
+        return await self._send_request("deleteWebhook", req, bool)
@@ -1,6 +1,9 @@
 from __future__ import annotations
-from typing import Any, List
+from typing import Any, List, Generic, TypeVar
 from pydantic import BaseModel, Field
+from pydantic.generics import GenericModel
+
+ResultT = TypeVar("ResultT")
 
 
 class TelegramException(Exception):
@@ -55,14 +58,29 @@ class GetUpdates(BaseModel):
     allowed_updates: List[str] | None
 
 
+class SetWebhook(BaseModel):
+    url: str
+    secret_token: str | None
+    max_connections: int | None
+    allowed_updates: List[str] | None
+    drop_pending_updates: bool | None
+
+
+class DeleteWebhook(BaseModel):
+    drop_pending_updates: bool | None
+
+
 class ResponseParameters(BaseModel):
     migrate_to_chat_id: int | None
     retry_after: int | None
 
 
-class TelegramReply(BaseModel):
+class TelegramReply(GenericModel, Generic[ResultT]):
+    """
+    Reply of a method with known result type, e.g. TelegramReply[List[ShortUpdate]]
+    """
     ok: bool
-    result: List[Update] | MessageId | Message | List[Message] | Chat | None
+    result: ResultT | None
     description: str | None
     error_code: int | None
     parameters: ResponseParameters | None
@@ -206,6 +224,28 @@ class Update(BaseModel):
     chat_join_request: Any | None  # todo: ChatJoinRequest
 
 
+# Short models contain only fields the bot uses, the rest of the payload is skipped while decoding
+
+class ShortUser(BaseModel):
+    id: int
+
+
+class ShortChat(BaseModel):
+    id: int
+    type: str
+
+
+class ShortMessage(MessageId):
+    from_user: ShortUser | None = Field(alias="from")
+    chat: ShortChat
+    text: str | None
+
+
+class ShortUpdate(BaseModel):
+    update_id: int
+    message: ShortMessage | None
+    channel_post: ShortMessage | None
+
+
 Message.update_forward_refs()
 Chat.update_forward_refs()
-TelegramReply.update_forward_refs()
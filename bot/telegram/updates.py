@@ -1,37 +1,66 @@
 import asyncio
+import contextlib
 from typing import List, AsyncIterable
 
 import aiohttp
-from pydantic import parse_obj_as, parse_raw_as
+from aioredis import Redis
 from logging import getLogger
-from .telegram_models import Update, TelegramReply, GetUpdates, TelegramException
+from .telegram_models import ShortUpdate, TelegramReply, GetUpdates, TelegramException
 from ..common.settings import get_settings
 
 
 class TelegramUpdates:
-    def __init__(self, bot_token: str):
+    def __init__(self, bot_token: str, redis: Redis | None = None,
+                 session: aiohttp.ClientSession | None = None):
         self.bot_token = bot_token
+        self.redis = redis
+        self.session = session
+        self.offset_key = f"telegram_offset_{bot_token.split(':')[0]}"
         self.logger = getLogger(__name__)
 
-    async def iter_updates(self) -> AsyncIterable[Update]:
-        url = get_settings().BOT_URL + self.bot_token + "/getUpdates"
-        get_updates_query = GetUpdates()
-        get_updates_query.timeout = 60
-        async with aiohttp.ClientSession() as session:
+    async def load_offset(self) -> int | None:
+        if not self.redis:
+            return None
+        offset = await self.redis.get(self.offset_key)
+        return int(offset) if offset else None
+
+    async def save_offset(self, offset: int) -> None:
+        if self.redis:
+            await self.redis.set(self.offset_key, offset)
+
+    async def iter_update_batches(self) -> AsyncIterable[List[ShortUpdate]]:
+        """
+        Yields whole getUpdates results,
+        offset is checkpointed once the consumer is done with a batch
+        """
+        settings = get_settings()
+        url = settings.BOT_URL + self.bot_token + "/getUpdates"
+        get_updates_query = GetUpdates(timeout=60,
+                                       limit=settings.updates_limit,
+                                       allowed_updates=settings.allowed_updates,
+                                       offset=await self.load_offset())
+        self.logger.info("Starting from offset %s", get_updates_query.offset)
+        async with contextlib.AsyncExitStack() as stack:
+            session = self.session
+            if session is None:
+                session = aiohttp.ClientSession()
+                stack.push_async_callback(session.close)
             while True:
                 try:
-                    async with session.post(url, json=get_updates_query.dict(exclude_unset=True)) as request:
+                    query = get_updates_query.dict(exclude_none=True)
+                    async with session.post(url, json=query) as request:
                         self.logger.debug(f"Got updates reply {request.status}")
                         raw = await request.read()
-                        reply: TelegramReply = parse_raw_as(TelegramReply, raw)
+                        reply: TelegramReply = TelegramReply[List[ShortUpdate]].parse_raw(raw)
                         if not reply.ok:
                             raise TelegramException(f"Telegram update failure {reply.error_code}: {reply.description}")
 
-                        updates = parse_obj_as(List[Update], reply.result)
+                        updates: List[ShortUpdate] = reply.result or []
 
-                        for update in updates:
-                            yield update
-                            get_updates_query.offset = update.update_id + 1
+                    if updates:
+                        yield updates
+                        get_updates_query.offset = updates[-1].update_id + 1
+                        await self.save_offset(get_updates_query.offset)
 
                 except asyncio.exceptions.TimeoutError:
                     self.logger.exception("Timeout")
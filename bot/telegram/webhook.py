@@ -0,0 +1,95 @@
+import asyncio
+from logging import getLogger
+from typing import Awaitable, Callable, List, Tuple
+
+from aiohttp import web
+from pydantic import ValidationError
+
+from .telegram_models import ShortUpdate
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class TelegramWebhook:
+    """
+    Accepts updates pushed by telegram, updates are handed over in batches.
+    A request is answered only after its batch was processed,
+    so telegram redelivers updates that were not.
+    Requests without the secret token are rejected,
+    anyone knowing the url could post forged updates otherwise.
+    """
+    def __init__(self, on_updates: Callable[[List[ShortUpdate]], Awaitable[None]],
+                 secret_token: str, path: str = "/webhook", batch_size: int = 100,
+                 flush_interval: float = 0.05):
+        if not secret_token:
+            raise ValueError("Webhook requires a secret token")
+        self.on_updates = on_updates
+        self.secret_token = secret_token
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending: List[Tuple[ShortUpdate, asyncio.Future]] = []
+        self.flush_task: asyncio.Task | None = None
+        self.runner: web.AppRunner | None = None
+        self.logger = getLogger("TelegramWebhook")
+
+    def register(self, app: web.Application) -> None:
+        app.router.add_post(self.path, self.handle)
+
+    async def start(self, host: str, port: int) -> None:
+        app = web.Application()
+        self.register(app)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.logger.info("Listening for updates on %s:%s%s", host, port, self.path)
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if request.headers.get(SECRET_HEADER) != self.secret_token:
+            self.logger.warning("Got update with a wrong secret token from %s", request.remote)
+            return web.Response(status=403)
+
+        try:
+            update = ShortUpdate.parse_raw(await request.read())
+        except ValidationError:
+            self.logger.warning("Could not parse update")
+            return web.Response(status=400)
+
+        done = asyncio.get_running_loop().create_future()
+        self.pending.append((update, done))
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+        elif not self.flush_task:
+            self.flush_task = asyncio.create_task(self.delayed_flush())
+
+        try:
+            await done
+        except Exception:
+            return web.Response(status=500)
+        return web.Response()
+
+    async def delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            await self.on_updates([update for update, _ in batch])
+        except Exception as ex:
+            self.logger.exception("Failed to process %s updates", len(batch))
+            for _, done in batch:
+                # the request handler is cancelled when its client disconnects
+                if not done.done():
+                    done.set_exception(ex)
+            return
+        for _, done in batch:
+            if not done.done():
+                done.set_result(None)
@@ -1,63 +1,141 @@
 import asyncio
-import logging.config
+import contextlib
 import os
 import random
-import signal
 import tempfile
 import uuid
 from logging import getLogger
-from typing import Tuple
+from typing import Tuple, List, AsyncIterator, Dict
 
 import aiohttp
 from pydantic import parse_raw_as
 
+from bot.common.logs import setup_logging
+from bot.common.metrics import FFMPEG_DURATION
 from bot.common.models import OutboundMessage, MediaItem
-from bot.common.pubsub import get_new_pubsub
+from bot.common.partitioning import owned_channels
+from bot.common.pubsub import get_new_pubsub, Pubsub
+from bot.common.redis import get_new_redis
+from bot.common.retry import RetryScheduler
 from bot.common.settings import get_settings
-from bot.telegram.client import TelegramClient, TelegramClientBadRequest, TelegramClientForbidden
-from bot.telegram.telegram_models import Message, InputMedia
+from bot.common.tracing import mark_media_ready, mark_delivered
+from bot.media.download import download, DownloadError
+from bot.media.processing import MediaProcessor, MediaProcessingError, read_file
+from bot.startup import run_service
+from bot.telegram.client import TelegramClient, TelegramClientBadRequest, TelegramClientForbidden, \
+    TelegramClientException, TelegramClientSizeException
+from bot.telegram.telegram_models import ShortMessage, InputMedia
 
 
 class ProcessingError(Exception):
     pass
 
 
-class TelegramMessenger:
+class TransientProcessingError(ProcessingError):
+    pass
+
+
+# descriptions of telegram errors about media it could not fetch or accept by url
+MEDIA_ERRORS = (
+    "wrong type of the web page content",
+    "failed to get http url content",
+    "wrong file identifier/http url specified",
+    "webpage_curl_failed",
+    "webpage_media_empty",
+    "photo_invalid_dimensions",
+    "image_process_failed",
+    "too big",
+)
+
+
+def is_media_error(ex: TelegramClientBadRequest) -> bool:
+    """
+    Whether telegram rejected the media itself rather than e.g. the chat or the caption
+    """
+    text = str(ex).lower()
+    return isinstance(ex, TelegramClientSizeException) \
+        or any(error in text for error in MEDIA_ERRORS)
+
+
+def select_image_url(image: MediaItem) -> str:
+    """
+    Largest variant telegram accepts as a photo and fitting max_image_pixels budget,
+    the smallest one if none fits
+    """
+    if not image.sizes or len(image.sizes) != len(image.urls):
+        return image.urls[-1]
+
+    max_pixels = get_settings().max_image_pixels
+    for url, size in zip(reversed(image.urls), reversed(image.sizes)):
+        if not size.width or not size.height:
+            continue
+        # telegram photo limits: width + height <= 10000, aspect ratio <= 20
+        if size.width + size.height > 10000 \
+                or max(size.width, size.height) > 20 * min(size.width, size.height):
+            continue
+        if size.width * size.height <= max_pixels:
+            return url
+    return image.urls[0]
 
-    MAX_URL_SIZE = 20 * 1024 * 1000
-    MAX_UPLOAD_SIZE = 50 * 1024 * 1000
 
-    def __init__(self, token: str):
+class TelegramMessenger:
+
+    def __init__(self, token: str, *, pubsub: Pubsub | None = None,
+                 retry_scheduler: RetryScheduler | None = None,
+                 session: aiohttp.ClientSession | None = None,
+                 media_slots: asyncio.Semaphore | None = None,
+                 media_processor: MediaProcessor | None = None):
         self.logger = getLogger()
         self.token = token
         self.bot_id = token.split(":")[0]
-        self.pubsub = get_new_pubsub()
-        self.tg_client = TelegramClient(self.token)
+        self.pubsub = pubsub or get_new_pubsub()
+        self.session = session or aiohttp.ClientSession()
+        self.tg_client = TelegramClient(self.token, self.session)
+        self.retry_scheduler = retry_scheduler or RetryScheduler(get_new_redis(), self.pubsub)
+        # limits concurrent ffmpeg jobs, shared by all bots of the process
+        self.media_slots = media_slots or asyncio.Semaphore(get_settings().media_workers)
+        self.media_processor = media_processor or MediaProcessor(self.session)
 
     async def serve(self):
-        reader = self.pubsub.stream_messages(f"telegram_{self.bot_id}")
+        channels = owned_channels(f"telegram_{self.bot_id}")
+        self.logger.info("Consuming %s", channels)
+        reader = self.pubsub.stream_messages(*channels)
         async for channel_id, message_id, message_raw in reader:
 
             outbound_message: OutboundMessage = parse_raw_as(OutboundMessage, message_raw)
-            self.logger.debug("Got new message %s", outbound_message)
+            post = outbound_message.post
+            self.logger.debug("Got new message %s for %s conversations",
+                              post.url if post else outbound_message.text,
+                              len(outbound_message.conversation_ids))
 
-            await self.process_message(outbound_message)
+            for retry_message in await self.process_message(outbound_message):
+                reason = f"{len(retry_message.conversation_ids)} conversations failed"
+                await self.retry_scheduler.retry(channel_id, retry_message.json(),
+                                                 retry_message.attempt, reason=reason)
 
             await self.pubsub.ack_message(channel_id, message_id)
 
     async def get_content_size(self, url: str) -> int:
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.head(url) as head:
-                    self.logger.debug("Got head for %s, %s, %s", url, head.status, head.content_length)
-                    if head.status <= 204:
-                        return head.content_length or 0
-                    else:
-                        raise ProcessingError(f"Unexpected status code {head.status}")
+            async with self.session.head(url) as head:
+                self.logger.debug("Got head for %s, %s, %s", url, head.status, head.content_length)
+                if head.status <= 204:
+                    return head.content_length or 0
+                elif head.status == 429 or head.status >= 500:
+                    raise TransientProcessingError(f"Unexpected status code {head.status}")
+                else:
+                    raise ProcessingError(f"Unexpected status code {head.status}")
         except aiohttp.ClientError as ex:
-            raise ProcessingError("Failed to get content_size") from ex
+            raise TransientProcessingError("Failed to get content_size") from ex
 
-    async def prepare_video(self, media_item: MediaItem) -> Tuple[str | None, bytes | None]:
+    @contextlib.asynccontextmanager
+    async def prepare_video(self, media_item: MediaItem
+                            ) -> AsyncIterator[Tuple[str | None, bytes | None]]:
+        """
+        Yields either url of a video telegram can fetch itself or merged video content.
+        With a local Bot API server merged video is passed as a file:// url instead of content.
+        """
+        settings = get_settings()
 
         self.logger.debug("Will look for suitable video in %s", media_item.urls)
 
@@ -71,41 +149,116 @@ class TelegramMessenger:
         for video_url in reversed(media_item.urls):
             sz = await self.get_content_size(video_url)
             self.logger.debug("Candidate size is %s", sz)
-            if audio_content_size == 0 and sz < self.MAX_URL_SIZE:
-                return video_url, None
-            elif sz + audio_content_size < self.MAX_UPLOAD_SIZE:
-                return None, await self.merge_and_read(video_url, media_item.audio)
+            if audio_content_size == 0 and sz < settings.max_url_size:
+                yield video_url, None
+                return
+            elif sz + audio_content_size < settings.max_upload_size:
+                # media_dir has to be shared with a local Bot API server
+                with tempfile.TemporaryDirectory(dir=settings.media_dir) as d:
+                    filename = os.path.join(d, str(uuid.uuid4()) + ".mp4")
+                    async with self.media_slots:
+                        await self.merge(video_url, media_item.audio, filename,
+                                         video_size=sz, audio_size=audio_content_size)
+                    if settings.bot_api_local:
+                        os.chmod(d, 0o755)
+                        os.chmod(filename, 0o644)
+                        yield "file://" + filename, None
+                    else:
+                        yield None, await asyncio.to_thread(read_file, filename)
+                return
         else:
             self.logger.warning("Could not find suitable video/audio")
-            return None, None
-
-    async def merge_and_read(self, video_url: str, audio_url: str | None) -> bytes:
-
-        with tempfile.TemporaryDirectory() as d:
-            filename = os.path.join(d, str(uuid.uuid4()) + ".mp4")
-            self.logger.debug("Going to run ffmpeg for %s, %s, output: %s", video_url, audio_url, filename)
-            cmd = f'ffmpeg -i "{video_url}" '
-            if audio_url:
-                cmd += f'-i "{audio_url}" '
-
-            cmd += f'-shortest -y "{filename}"'
+            yield None, None
+
+    async def merge(self, video_url: str, audio_url: str | None, filename: str, *,
+                    video_size: int | None = None, audio_size: int | None = None) -> None:
+        settings = get_settings()
+        # segments are fetched in parallel with range requests, ffmpeg works with local files only
+        directory = os.path.dirname(filename)
+        inputs = [(video_url, os.path.join(directory, "video.mp4"), video_size)]
+        if audio_url:
+            inputs.append((audio_url, os.path.join(directory, "audio.mp4"), audio_size or None))
+        try:
+            await asyncio.gather(*(download(self.session, url, path, size=size,
+                                            parts=settings.download_parts,
+                                            attempts=settings.download_attempts)
+                                   for url, path, size in inputs))
+        except DownloadError as ex:
+            raise TransientProcessingError(f"Failed to download {video_url}") from ex
+
+        cmd = ["ffmpeg"]
+        for _, path, __ in inputs:
+            cmd += ["-i", path]
+        cmd += ["-c", "copy", "-shortest", "-y", filename]
+        self.logger.debug("Going to run %s", cmd)
+
+        proc = await asyncio.create_subprocess_exec(*cmd)
+        try:
+            with FFMPEG_DURATION.time():
+                rc = await asyncio.wait_for(proc.wait(), settings.ffmpeg_timeout)
+        except asyncio.TimeoutError:
+            self.logger.error("Timeout waiting for ffmpeg, killing")
+            proc.kill()
+            # reaps the process and closes its transport
+            await proc.wait()
+            raise TransientProcessingError("ffmpeg process timeout")
+        if rc != 0:
+            raise ProcessingError(f"Non zero rc code for ffmpeg {rc}")
+
+    async def process_photo(self, url: str) -> bytes:
+        try:
+            return await self.media_processor.photo(url)
+        except MediaProcessingError as ex:
+            raise TelegramClientBadRequest(f"Could not process photo {url}") from ex
 
-            proc = await asyncio.create_subprocess_shell(cmd)
+    async def convert_video(self, url: str) -> bytes:
+        try:
+            async with self.media_slots:
+                return await self.media_processor.video(url)
+        except MediaProcessingError as ex:
+            raise TelegramClientBadRequest(f"Could not convert video {url}") from ex
+
+    async def process_media_group(self, media: List[InputMedia]
+                                  ) -> Tuple[List[InputMedia], Dict[str, bytes]]:
+        """
+        Uploads processed images instead of urls, images that could not be processed are dropped
+        """
+        result = []
+        files = {}
+        for index, item in enumerate(media):
             try:
-                rc = await asyncio.wait_for(proc.wait(), 600)
-            except asyncio.TimeoutError:
-                self.logger.error("Timeout waiting for ffmpeg, killing")
-                try:
-                    os.killpg(proc.pid, signal.SIGKILL)
-                except:
-                    proc.kill()
-                raise ProcessingError("ffmpeg process timeout")
-            if rc != 0:
-                raise ProcessingError("Non zero rc code for ffmpeg %s", rc)
-            with open(filename, "rb") as f:
-                return f.read()
-
-    async def process_message(self, message: OutboundMessage):
+                files[f"photo{index}"] = await self.media_processor.photo(item.media)
+            except MediaProcessingError:
+                self.logger.exception("Dropping image %s from media group", item.media)
+                continue
+            result.append(item.copy(update={"media": f"attach://photo{index}"}))
+        return result, files
+
+    async def send_media_group(self, chat_id: str, media: List[InputMedia],
+                               files: Dict[str, bytes] | None) -> None:
+        """
+        A media group needs at least two items,
+        a single one left after processing is sent as a photo
+        """
+        if len(media) > 1 or not files:
+            await self.tg_client.send_media_group(chat_id, media, files)
+        else:
+            photo_bytes = files[media[0].media.removeprefix("attach://")]
+            await self.tg_client.send_photo(chat_id, caption=media[0].caption,
+                                            photo_bytes=photo_bytes)
+
+    async def process_message(self, message: OutboundMessage) -> List[OutboundMessage]:
+        """
+        Delivers message to its conversations.
+        Returns messages to retry for conversations which failed with a transient error,
+        each one keeps only the parts (text, media group, video or photo) that were not delivered
+        """
+        failed_text: List[str] = []
+        failed_group: List[str] = []
+        failed: List[str] = []
+        # chats the video or photo was not sent to yet,
+        # retried when media processing fails transiently
+        unattempted: List[str] = []
         try:
             if message.text:
                 for chat_id in message.conversation_ids:
@@ -113,10 +266,13 @@ class TelegramMessenger:
                         await self.tg_client.send_message(chat_id, message.text)
                     except (TelegramClientBadRequest, TelegramClientForbidden) as ex:
                         self.logger.warning(f"Could not send text to chat {chat_id}, {ex}")
+                    except TelegramClientException as ex:
+                        self.logger.warning(f"Transient error sending text to chat {chat_id}, {ex}")
+                        failed_text.append(chat_id)
 
             post = message.post
             if not post:
-                return
+                return retry_messages(message, failed_text, failed_group, failed)
 
             caption = f'<a href="{post.original_url}">{post.source_text or post.source_id}</a>: ' \
                       f'<a href="{post.url}">{post.text or "..."}</a>'
@@ -129,58 +285,152 @@ class TelegramMessenger:
                 media = [
                     InputMedia(
                         type="photo",
-                        media=image.urls[-1],
+                        media=select_image_url(image),
                         caption=image.caption or caption,
                         parse_mode="HTML") for image in src]
 
                 # copyMessage does not work with media groups
-                for chat_id in message.conversation_ids:
+                files: Dict[str, bytes] | None = None
+                mark_media_ready(post)
+                for index, chat_id in enumerate(message.conversation_ids):
                     try:
-                        await self.tg_client.send_media_group(chat_id, media)
+                        try:
+                            await self.send_media_group(chat_id, media, files)
+                        except TelegramClientBadRequest as ex:
+                            if files is not None or not is_media_error(ex):
+                                raise
+                            self.logger.warning(
+                                f"Media group was rejected, uploading processed images, {ex}")
+                            media, files = await self.process_media_group(media)
+                            if not media:
+                                # images could not be downloaded, retried later
+                                self.logger.warning(
+                                    "None of the media group images could be processed")
+                                failed_group.extend(message.conversation_ids[index:])
+                                break
+                            await self.send_media_group(chat_id, media, files)
+                        mark_delivered(post, chat_id)
                     except (TelegramClientBadRequest, TelegramClientForbidden) as ex:
                         self.logger.warning(f"Could not send media group to chat {chat_id}, {ex}")
+                    except TelegramClientException as ex:
+                        self.logger.warning(
+                            f"Transient error sending media group to chat {chat_id}, {ex}")
+                        failed_group.append(chat_id)
 
-            reply: Message | None = None
+            reply: ShortMessage | None = None
             for index, first_chat_id in enumerate(message.conversation_ids):
+                unattempted = message.conversation_ids[index:]
                 try:
                     if post.videos:
                         # todo: multiple videos?
-                        video_url, video_data = await self.prepare_video(post.videos[0])
-                        if video_url:
-                            reply = await self.tg_client.send_video(first_chat_id,
-                                                                    caption=post.videos[0].caption or caption,
-                                                                    video_url=video_url)
-                        elif video_data:
-                            reply = await self.tg_client.send_video(first_chat_id,
-                                                                    caption=post.videos[0].caption or caption,
-                                                                    video_bytes=video_data)
+                        video_caption = post.videos[0].caption or caption
+                        async with self.prepare_video(post.videos[0]) as (video_url, video_data):
+                            mark_media_ready(post)
+                            if video_url:
+                                try:
+                                    reply = await self.tg_client.send_video(
+                                        first_chat_id, caption=video_caption, video_url=video_url)
+                                except TelegramClientBadRequest as ex:
+                                    if not is_media_error(ex):
+                                        raise
+                                    self.logger.warning(
+                                        f"Video was rejected, uploading converted one, {ex}")
+                                    video_data = await self.convert_video(video_url)
+                            if video_data and not reply:
+                                reply = await self.tg_client.send_video(
+                                    first_chat_id, caption=video_caption, video_bytes=video_data)
 
                     if post.images and len(post.images) == 1:
-                        reply = await self.tg_client.send_photo(first_chat_id,
-                                                                caption=post.images[0].caption or caption,
-                                                                photo_url=post.images[0].urls[-1])
+                        photo_url = select_image_url(post.images[0])
+                        photo_caption = post.images[0].caption or caption
+                        mark_media_ready(post)
+                        try:
+                            reply = await self.tg_client.send_photo(
+                                first_chat_id, caption=photo_caption, photo_url=photo_url)
+                        except TelegramClientBadRequest as ex:
+                            if not is_media_error(ex):
+                                raise
+                            self.logger.warning(
+                                f"Photo was rejected, uploading processed one, {ex}")
+                            photo_bytes = await self.process_photo(photo_url)
+                            reply = await self.tg_client.send_photo(
+                                first_chat_id, caption=photo_caption, photo_bytes=photo_bytes)
                 except (TelegramClientBadRequest, TelegramClientForbidden) as ex:
                     self.logger.warning(f"Could not send msg to {first_chat_id}, {ex}")
                     continue
+                except TelegramClientException as ex:
+                    self.logger.warning(f"Transient error sending msg to {first_chat_id}, {ex}")
+                    failed.append(first_chat_id)
+                    continue
 
                 if reply:
+                    mark_delivered(post, first_chat_id)
                     for chat_id in message.conversation_ids[index+1:]:
                         try:
                             await self.tg_client.copy_message(chat_id, first_chat_id, reply.message_id)
+                            mark_delivered(post, chat_id)
                         except (TelegramClientBadRequest, TelegramClientForbidden) as ex:
                             self.logger.warning(f"Could not copy message to {chat_id}, {ex}")
+                        except TelegramClientException as ex:
+                            self.logger.warning(
+                                f"Transient error copying message to {chat_id}, {ex}")
+                            failed.append(chat_id)
                 break
 
+        except TransientProcessingError as ex:
+            self.logger.warning(f"Transient error processing the post, {ex}")
+            # media is prepared before anything is sent to the current first chat
+            failed.extend(unattempted)
         except ProcessingError:
-            self.logger.exception("Could not process the post")
+            self.logger.exception("Could not process the post, dropping it")
+
+        return retry_messages(message, failed_text, failed_group, failed)
+
+
+def retry_messages(message: OutboundMessage, failed_text: List[str], failed_group: List[str],
+                   failed: List[str]) -> List[OutboundMessage]:
+    """
+    Retry of every delivery step only for the conversations it failed for,
+    so nothing is delivered twice
+    """
+    attempt = message.attempt + 1
+    result = []
+    if failed_text:
+        result.append(message.copy(update={"conversation_ids": list(dict.fromkeys(failed_text)),
+                                           "post": None, "attempt": attempt}))
+    post = message.post
+    if post and failed_group:
+        result.append(message.copy(update={"conversation_ids": list(dict.fromkeys(failed_group)),
+                                           "text": None, "post": post.copy(update={"videos": None}),
+                                           "attempt": attempt}))
+    if post and failed:
+        # the media group was handled separately, the rest is the video or the single photo
+        if post.images and len(post.images) > 1:
+            post = post.copy(update={"images": None})
+        result.append(message.copy(update={"conversation_ids": list(dict.fromkeys(failed)),
+                                           "text": None, "post": post, "attempt": attempt}))
+    return result
+
+
+# services waited for before main starts
+DEPENDENCIES = ("rabbitmq", "redis")
 
 
 async def main():
-    token = get_settings().bot_token
-    messenger = TelegramMessenger(token)
-    await messenger.serve()
+    # bots share broker and redis connections, the http connection pool and media workers
+    pubsub = get_new_pubsub()
+    retry_scheduler = RetryScheduler(get_new_redis(), pubsub)
+    media_slots = asyncio.Semaphore(get_settings().media_workers)
+    async with aiohttp.ClientSession() as session:
+        media_processor = MediaProcessor(session)
+        messengers = [TelegramMessenger(token, pubsub=pubsub, retry_scheduler=retry_scheduler,
+                                        session=session, media_slots=media_slots,
+                                        media_processor=media_processor)
+                      for token in get_settings().get_bot_tokens()]
+        await asyncio.gather(retry_scheduler.serve(),
+                             *(messenger.serve() for messenger in messengers))
 
 
 if __name__ == "__main__":
-    logging.config.fileConfig("logger.ini")
-    asyncio.run(main())
+    setup_logging()
+    run_service(main, DEPENDENCIES)
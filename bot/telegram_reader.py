@@ -1,51 +1,139 @@
+import argparse
 import asyncio
-import logging.config
-import os
 from logging import getLogger
+from typing import List
 
+import aiohttp
+from aiohttp import web
+from aioredis import Redis
+
+from bot.common.logs import setup_logging
 from bot.common.pubsub import Pubsub, get_new_pubsub
+from bot.common.redis import get_new_redis
 from bot.common.settings import get_settings
-from bot.telegram.telegram_models import Message
+from bot.telegram.client import TelegramClient
+from bot.telegram.telegram_models import ShortMessage, ShortUpdate
 from bot.telegram.updates import TelegramUpdates
+from bot.telegram.webhook import TelegramWebhook
 from bot.common.models import IncomingMessage
+from bot.startup import run_service
 
 
 class UpdateReader:
 
-    def __init__(self, tg_bot_token: str):
+    def __init__(self, tg_bot_token: str, *, pubsub: Pubsub | None = None,
+                 redis: Redis | None = None, session: aiohttp.ClientSession | None = None):
         self.token = tg_bot_token
         self.bot_id = tg_bot_token.split(":")[0]
-        self.tg_updates = TelegramUpdates(self.token)
+        self.session = session
+        self.tg_updates = TelegramUpdates(self.token, redis or get_new_redis(), session)
 
-        self.pubsub: Pubsub = get_new_pubsub()
+        self.pubsub: Pubsub = pubsub or get_new_pubsub()
 
         self.logger = getLogger("UpdateReader")
 
     async def serve(self):
-        async for update in self.tg_updates.iter_updates():
+        # getUpdates does not work while a webhook is set
+        async with aiohttp.ClientSession() as session:
+            await TelegramClient(self.token, self.session or session).delete_webhook()
+        async for updates in self.tg_updates.iter_update_batches():
+            await self.process_updates(updates)
+
+    def get_webhook(self) -> TelegramWebhook:
+        settings = get_settings()
+        return TelegramWebhook(self.process_updates,
+                               secret_token=settings.webhook_secret,
+                               path=f"/webhook/{self.bot_id}",
+                               batch_size=settings.webhook_batch_size,
+                               flush_interval=settings.webhook_flush_interval)
+
+    def get_message(self, update: ShortUpdate) -> ShortMessage | None:
+        if update.message and update.message.text:
+            return update.message
+        elif update.channel_post and update.channel_post.text:
+            return update.channel_post
+        return None
+
+    async def process_updates(self, updates: List[ShortUpdate]):
+        messages = []
+        for update in updates:
             self.logger.debug(f"Got update {update}")
-            if update.message and update.message.text:
-                await self.process_message(update.message)
-            elif update.channel_post and update.channel_post.text:
-                await self.process_message(update.channel_post)
-
-    async def process_message(self, message: Message):
-        ch = "incoming_message"
-        msg = IncomingMessage(provider=f"telegram_{self.bot_id}",
-                              conversation_id=str(message.chat.id),
-                              from_user_id=str(message.from_user.id) if message.from_user else "",
-                              payload=message.text,
-                              message_id=message.message_id)
-        self.logger.debug(f"Going to send {msg} to {ch}")
-        await self.pubsub.publish(ch, msg.json())
+            if message := self.get_message(update):
+                messages.append(self.to_incoming_message(message).json())
+        if messages:
+            self.logger.debug(f"Going to send {len(messages)} messages")
+            await self.pubsub.publish_many("incoming_message", messages)
+
+    def to_incoming_message(self, message: ShortMessage) -> IncomingMessage:
+        return IncomingMessage(provider=f"telegram_{self.bot_id}",
+                               conversation_id=str(message.chat.id),
+                               from_user_id=str(message.from_user.id) if message.from_user else "",
+                               payload=message.text,
+                               message_id=message.message_id)
+
+
+async def set_webhook(token: str):
+    settings = get_settings()
+    if not settings.webhook_secret:
+        raise ValueError("webhook_secret has to be set, "
+                         "otherwise anyone knowing the url could post updates")
+    bot_id = token.split(":")[0]
+    url = f"{settings.webhook_url.rstrip('/')}/webhook/{bot_id}"
+    async with aiohttp.ClientSession() as session:
+        await TelegramClient(token, session).set_webhook(url, secret_token=settings.webhook_secret,
+                                                         allowed_updates=settings.allowed_updates)
+    print(f"Webhook is set to {url}")
+
+
+async def delete_webhook(token: str):
+    async with aiohttp.ClientSession() as session:
+        await TelegramClient(token, session).delete_webhook()
+    print("Webhook is deleted")
+
+
+async def serve_webhooks(readers: List[UpdateReader]):
+    settings = get_settings()
+    app = web.Application()
+    for reader in readers:
+        reader.get_webhook().register(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, settings.webhook_host, settings.webhook_port).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+# services waited for before main starts
+DEPENDENCIES = ("rabbitmq", "redis")
 
 
 async def main():
-    token = get_settings().bot_token
-    publisher = UpdateReader(token)
-    await publisher.serve()
+    # all bots share broker and redis connections and the http connection pool
+    pubsub = get_new_pubsub()
+    redis = get_new_redis()
+    async with aiohttp.ClientSession() as session:
+        readers = [UpdateReader(token, pubsub=pubsub, redis=redis, session=session)
+                   for token in get_settings().get_bot_tokens()]
+        if get_settings().reader_mode == "webhook":
+            await serve_webhooks(readers)
+        else:
+            await asyncio.gather(*(reader.serve() for reader in readers))
 
 
 if __name__ == "__main__":
-    logging.config.fileConfig("logger.ini")
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Reads telegram updates")
+    parser.add_argument("--set-webhook", action="store_true", help="register webhook_url and exit")
+    parser.add_argument("--delete-webhook", action="store_true", help="remove webhook and exit")
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.set_webhook:
+        for token in get_settings().get_bot_tokens():
+            asyncio.run(set_webhook(token))
+    elif args.delete_webhook:
+        for token in get_settings().get_bot_tokens():
+            asyncio.run(delete_webhook(token))
+    else:
+        run_service(main, DEPENDENCIES)
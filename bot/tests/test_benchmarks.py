@@ -0,0 +1,20 @@
+from bot.benchmarks.hot_path import find_regressions, measure, main
+
+
+def test_find_regressions():
+    baseline = {"parse": 0.010, "convert": 0.020}
+    results = {"parse": 0.0119, "convert": 0.025, "new case": 1.0}
+    assert find_regressions(results, baseline, 0.2) == ["convert"]
+
+
+def test_measure():
+    calls = []
+    assert measure(lambda: calls.append(1), 3) >= 0
+    assert len(calls) == 4
+
+
+def test_missing_baseline_fails(monkeypatch, tmp_path):
+    monkeypatch.setattr("bot.benchmarks.hot_path.run", lambda rounds: {"parse": 0.01})
+    assert main(1, str(tmp_path / "missing.json"), 0.2, save=False) == 1
+    assert main(1, str(tmp_path / "baseline.json"), 0.2, save=True) == 0
+    assert main(1, str(tmp_path / "baseline.json"), 0.2, save=False) == 0
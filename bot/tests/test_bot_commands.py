@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from bot.bot import Web2TgBot
+from bot.common.models import IncomingMessage
+
+
+class RecordingBot(Web2TgBot):
+    def __init__(self):
+        super().__init__()
+        self.processed = []
+
+    async def process_incoming_message(self, message: IncomingMessage):
+        # first command of a conversation is the slowest one
+        await asyncio.sleep(0.05 if message.payload == "/start" else 0)
+        self.processed.append((message.conversation_id, message.payload))
+
+
+def message(conversation_id: str, payload: str) -> IncomingMessage:
+    return IncomingMessage(conversation_id=conversation_id, from_user_id="1", payload=payload,
+                           provider="telegram_1")
+
+
+@pytest.mark.asyncio
+async def test_commands_ordered_per_conversation():
+    bot = RecordingBot()
+    await asyncio.gather(
+        bot.handle_command(message("1", "/start")),
+        bot.handle_command(message("1", "/list")),
+        bot.handle_command(message("2", "/list")),
+    )
+
+    assert bot.processed == [("2", "/list"), ("1", "/start"), ("1", "/list")]
+    assert bot.conversation_locks == {}
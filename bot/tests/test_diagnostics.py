@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import time
+import tracemalloc
+
+import pytest
+
+from bot.common.diagnostics import LoopMonitor, SamplingProfiler, Diagnostics
+
+
+def busy(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_blocked_loop_is_logged(caplog):
+    monitor = LoopMonitor(interval=0.02, slow_callback=0.05)
+    task = asyncio.create_task(monitor.serve())
+    await asyncio.sleep(0.05)
+    with caplog.at_level(logging.WARNING, logger="diagnostics"):
+        busy(0.3)
+        await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert any("blocked" in message and "busy" in message for message in messages)
+    assert any("Event loop lag" in message for message in messages)
+
+
+def test_sampling_profiler():
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    busy(0.1)
+    samples = profiler.stop()
+    assert any("busy" in stack for stack in samples)
+
+
+@pytest.mark.asyncio
+async def test_dumps(tmp_path):
+    diagnostics = Diagnostics(str(tmp_path))
+    diagnostics.start_profile()
+    busy(0.05)
+    profile = await diagnostics.stop_profile()
+    assert "busy" in open(profile).read()
+
+    assert await diagnostics.snapshot() == "tracemalloc is not running"
+    diagnostics.start_tracemalloc()
+    try:
+        snapshot = await diagnostics.snapshot()
+    finally:
+        tracemalloc.stop()
+    assert tracemalloc.Snapshot.load(snapshot)
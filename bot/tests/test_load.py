@@ -0,0 +1,52 @@
+import pytest
+
+from bot.benchmarks.load import FakeReddit, FakeTelegram, start_app
+from bot.common.settings import get_settings
+from bot.scrap.reddit import RedditPosts, reddit_post_to_message
+from bot.scrap.reddit_models import SubredditListing
+from bot.telegram.client import TelegramClient, TelegramClientException
+from bot.telegram.telegram_models import InputMedia
+
+REDDIT_PORT = 8098
+TELEGRAM_PORT = 8099
+
+
+@pytest.mark.asyncio
+async def test_fakes(monkeypatch):
+    reddit_url = f"http://127.0.0.1:{REDDIT_PORT}"
+    monkeypatch.setattr(get_settings(), "RD_BASE_URL", f"{reddit_url}/r/")
+    monkeypatch.setattr(get_settings(), "BOT_URL", f"http://127.0.0.1:{TELEGRAM_PORT}/bot")
+    monkeypatch.setattr(get_settings(), "telegram_request_attempts", 1)
+
+    reddit = FakeReddit(reddit_url, post_rate=1000, media_weights=[1, 1, 1], media_size=10)
+    reddit.started -= 1  # a full page of posts is already there
+    telegram = FakeTelegram(reddit, latency=0, chat_rate=1, flood_rate=0, upload_throughput=0)
+    runners = [await start_app(reddit, port=REDDIT_PORT),
+               await start_app(telegram, port=TELEGRAM_PORT)]
+    rd_posts = RedditPosts()
+    client = TelegramClient("1:TOKEN")
+    try:
+        items = await rd_posts.get_posts(SubredditListing(subreddit="loadtest", sorting="new"))
+        posts = [reddit_post_to_message("reddit@loadtest", item.data) for item in items]
+        assert posts
+        assert {bool(post.images and len(post.images) > 1) for post in posts} == {True, False}
+        assert any(post.videos for post in posts)
+
+        post = posts[0]
+        caption = f'<a href="{post.original_url}">x</a>: <a href="{post.url}">y</a>'
+        reply = await client.send_photo(1, caption=caption, photo_url="url")
+        await client.copy_message(2, 1, reply.message_id)
+        media = [InputMedia(type="photo", media="url", caption=caption)] * 2
+        await client.send_media_group(3, media)
+        # per chat limit
+        with pytest.raises(TelegramClientException):
+            await client.send_message(1, "text")
+    finally:
+        await rd_posts.session.close()
+        await client.session.close()
+        for runner in runners:
+            await runner.cleanup()
+
+    assert len(telegram.delivered[items[0].data.id]) == 3
+    assert telegram.flood_waits == 1
+    assert telegram.calls["sendPhoto"] == 1
@@ -0,0 +1,65 @@
+import logging
+import queue
+
+from bot.common.logs import shorten, RateLimitFilter, TruncatingQueueHandler
+
+
+def make_record(msg: str, *args, level: int = logging.INFO, lineno: int = 1) -> logging.LogRecord:
+    return logging.LogRecord("test", level, "test.py", lineno, msg, args, None)
+
+
+def test_shorten():
+    assert shorten("short", 10) == "short"
+    text = shorten("x" * 100, 10)
+    assert text.startswith("x" * 10 + "... (100 chars, sha1 ")
+
+
+def test_rate_limit():
+    rate_filter = RateLimitFilter(rate=0.001, burst=3)
+    assert [rate_filter.filter(make_record("a")) for _ in range(5)] == \
+           [True, True, True, False, False]
+    # other call sites have their own budget
+    assert rate_filter.filter(make_record("b", lineno=2))
+
+    rate_filter.buckets[("test.py", 1)][0] = 1
+    record = make_record("a")
+    assert rate_filter.filter(record)
+    assert record.getMessage() == "a [2 similar messages suppressed]"
+
+
+def test_debug_sampling():
+    rate_filter = RateLimitFilter(rate=0, burst=0, debug_sample=0)
+    assert not rate_filter.filter(make_record("debug", level=logging.DEBUG))
+    assert rate_filter.filter(make_record("error", level=logging.ERROR))
+
+
+def test_truncating_handler():
+    log_queue = queue.SimpleQueue()
+    handler = TruncatingQueueHandler(log_queue, max_length=20)
+    record = make_record("Data were %s, %s", "y" * 1000, 42)
+    handler.handle(record)
+    queued = log_queue.get_nowait()
+    assert queued.getMessage().startswith("Data were yyyy")
+    assert "sha1" in queued.getMessage()
+    assert len(queued.getMessage()) < 200
+    # the original record is left intact for other handlers
+    assert record.args[0] == "y" * 1000
+
+
+def test_arguments_formatted_later():
+    class Post:
+        formatted = 0
+
+        def __str__(self):
+            self.formatted += 1
+            return "p" * 1000
+
+    log_queue = queue.SimpleQueue()
+    handler = TruncatingQueueHandler(log_queue, max_length=20)
+    post = Post()
+    handler.handle(make_record("Got new post %s, %d", post, 3))
+    queued = log_queue.get_nowait()
+    # the listener thread formats the record
+    assert not post.formatted
+    assert queued.getMessage().startswith("Got new post " + "p" * 20 + "... (1000 chars")
+    assert queued.getMessage().endswith(", 3")
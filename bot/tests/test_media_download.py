@@ -0,0 +1,78 @@
+import os
+
+import aiohttp
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from bot.media.download import download, split_ranges
+
+PORT = 8096
+DATA = os.urandom(1024 * 1024 + 17)
+
+
+@pytest_asyncio.fixture
+async def media_server():
+    failures = {"count": 1}
+
+    async def with_ranges(request: web.Request):
+        response = web.StreamResponse(status=200)
+        response.headers["Accept-Ranges"] = "bytes"
+        data = DATA
+        if range_header := request.headers.get("Range"):
+            start, end = range_header[len("bytes="):].split("-")
+            data = DATA[int(start):int(end) + 1 if end else None]
+            response.set_status(206)
+        response.content_length = len(data)
+        await response.prepare(request)
+        if request.method == "HEAD":
+            return response
+        if failures["count"] and len(data) > 1000:
+            # first big range is cut in the middle
+            failures["count"] -= 1
+            await response.write(data[:1000])
+            if request.transport:
+                request.transport.close()
+            return response
+        await response.write(data)
+        return response
+
+    async def without_ranges(request: web.Request):
+        return web.Response(body=DATA)
+
+    app = web.Application()
+    app.router.add_route("*", "/ranges.mp4", with_ranges)
+    app.router.add_route("*", "/plain.mp4", without_ranges)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    yield f"http://127.0.0.1:{PORT}/"
+    await runner.cleanup()
+
+
+def test_split_ranges():
+    assert split_ranges(10, 3) == [(0, 3), (4, 7), (8, 9)]
+    assert split_ranges(2, 4) == [(0, 0), (1, 1)]
+
+
+@pytest.mark.asyncio
+async def test_parallel_download_resumes(media_server, tmp_path):
+    filename = str(tmp_path / "video.mp4")
+    async with aiohttp.ClientSession() as session:
+        size = await download(session, media_server + "ranges.mp4", filename, parts=4)
+
+    assert size == len(DATA)
+    with open(filename, "rb") as f:
+        assert f.read() == DATA
+
+
+@pytest.mark.asyncio
+async def test_download_without_ranges(media_server, tmp_path):
+    filename = str(tmp_path / "video.mp4")
+    async with aiohttp.ClientSession() as session:
+        size = await download(session, media_server + "plain.mp4", filename, size=len(DATA),
+                              parts=4)
+
+    assert size == len(DATA)
+    with open(filename, "rb") as f:
+        assert f.read() == DATA
@@ -0,0 +1,33 @@
+import io
+import random
+
+import pytest
+from PIL import Image
+
+from bot.media.processing import shrink_image, MediaProcessingError
+
+
+def png(width: int, height: int) -> bytes:
+    rnd = random.Random(1)
+    pixels = bytes(rnd.getrandbits(8) for _ in range(width * height * 3))
+    image = Image.frombytes("RGB", (width, height), pixels)
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_shrink_image_side():
+    data = shrink_image(png(400, 100), max_side=200, max_bytes=10 ** 6)
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.format == "JPEG"
+        assert image.size == (200, 50)
+
+
+def test_shrink_image_bytes():
+    data = shrink_image(png(300, 300), max_side=300, max_bytes=20_000)
+    assert len(data) <= 20_000
+
+
+def test_shrink_image_does_not_fit():
+    with pytest.raises(MediaProcessingError):
+        shrink_image(png(300, 300), max_side=300, max_bytes=100)
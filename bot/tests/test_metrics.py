@@ -0,0 +1,47 @@
+import pytest
+from aiohttp import web
+from prometheus_client import REGISTRY
+
+from bot.common.settings import get_settings
+from bot.telegram.client import TelegramClient, TelegramClientException
+
+PORT = 8097
+
+
+def sample(name: str, method: str) -> float:
+    return REGISTRY.get_sample_value(name, {"method": method}) or 0
+
+
+@pytest.mark.asyncio
+async def test_telegram_metrics(monkeypatch):
+    async def send_message(request: web.Request):
+        message = {"message_id": 1, "chat": {"id": 1, "type": "private"}}
+        return web.json_response({"ok": True, "result": message})
+
+    async def send_photo(request: web.Request):
+        return web.json_response({"ok": False, "error_code": 429, "parameters": {"retry_after": 1}},
+                                 status=429)
+
+    app = web.Application()
+    app.router.add_post("/bot123:TOKEN/sendMessage", send_message)
+    app.router.add_post("/bot123:TOKEN/sendPhoto", send_photo)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    monkeypatch.setattr(get_settings(), "BOT_URL", f"http://127.0.0.1:{PORT}/bot")
+
+    requests = sample("telegram_request_seconds_count", "sendMessage")
+    flood_waits = sample("telegram_flood_waits_total", "sendPhoto")
+    uploaded = sample("telegram_uploaded_bytes_total", "sendMessage")
+    client = TelegramClient("123:TOKEN")
+    try:
+        await client.send_message(1, "text")
+        with pytest.raises(TelegramClientException):
+            await client.send_photo(1, photo_bytes=b"12345")
+    finally:
+        await client.session.close()
+        await runner.cleanup()
+
+    assert sample("telegram_request_seconds_count", "sendMessage") == requests + 1
+    assert sample("telegram_flood_waits_total", "sendPhoto") == flood_waits + 1
+    assert sample("telegram_uploaded_bytes_total", "sendMessage") == uploaded
@@ -0,0 +1,31 @@
+import pytest
+
+from bot.common.partitioning import split_by_partition, get_partition, parse_partitions, \
+    partition_channel
+
+
+def test_single_partition_keeps_channel():
+    result = split_by_partition("telegram_1", ["1", "2", "3"], 1)
+    assert result == {"telegram_1": ["1", "2", "3"]}
+
+
+def test_split_by_partition():
+    conversations = [str(i) for i in range(100)]
+    result = split_by_partition("telegram_1", conversations, 4)
+
+    assert set(result.keys()) <= {"telegram_1_0", "telegram_1_1", "telegram_1_2", "telegram_1_3"}
+    assert sorted(sum(result.values(), []), key=int) == conversations
+    for channel, convs in result.items():
+        for conv in convs:
+            assert partition_channel("telegram_1", get_partition(conv, 4), 4) == channel
+
+
+def test_partition_is_stable():
+    assert get_partition("-100123456", 8) == get_partition("-100123456", 8)
+
+
+def test_parse_partitions():
+    assert parse_partitions("", 3) == [0, 1, 2]
+    assert parse_partitions("2, 0", 3) == [0, 2]
+    with pytest.raises(ValueError):
+        parse_partitions("3", 3)
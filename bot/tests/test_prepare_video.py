@@ -0,0 +1,51 @@
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from bot.common.models import MediaItem
+from bot.common.settings import get_settings
+from bot.telegram_messenger import TelegramMessenger
+
+PORT = 8095
+SIZES = {"DASH_240.mp4": 1000, "DASH_720.mp4": 30 * 1024 * 1000}
+
+
+@pytest_asyncio.fixture
+async def media_server():
+    async def head(request: web.Request):
+        return web.Response(headers={"Content-Length": str(SIZES[request.match_info["name"]])})
+
+    app = web.Application()
+    app.router.add_route("HEAD", "/{name}", head)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    yield f"http://127.0.0.1:{PORT}/"
+    await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_prepare_video_picks_largest_url(media_server, monkeypatch):
+    monkeypatch.setattr(get_settings(), "max_upload_size", 0)
+    messenger = TelegramMessenger("123:TOKEN")
+    item = MediaItem(urls=[media_server + "DASH_240.mp4", media_server + "DASH_720.mp4"])
+
+    async with messenger.prepare_video(item) as (video_url, video_data):
+        assert video_url == media_server + "DASH_240.mp4"
+        assert video_data is None
+
+    monkeypatch.setattr(get_settings(), "max_url_size", 100 * 1024 * 1000)
+    async with messenger.prepare_video(item) as (video_url, video_data):
+        assert video_url == media_server + "DASH_720.mp4"
+
+
+@pytest.mark.asyncio
+async def test_prepare_video_too_big(media_server, monkeypatch):
+    monkeypatch.setattr(get_settings(), "max_url_size", 10)
+    monkeypatch.setattr(get_settings(), "max_upload_size", 10)
+    messenger = TelegramMessenger("123:TOKEN")
+    item = MediaItem(urls=[media_server + "DASH_240.mp4", media_server + "DASH_720.mp4"])
+
+    async with messenger.prepare_video(item) as (video_url, video_data):
+        assert video_url is None
+        assert video_data is None
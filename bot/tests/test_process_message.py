@@ -0,0 +1,173 @@
+import contextlib
+from typing import List
+
+import pytest
+
+from bot.common.models import MediaItem, OutboundMessage, Post
+from bot.media.processing import MediaProcessingError
+from bot.telegram.client import TelegramClientTransientError, TelegramClientBadRequest
+from bot.telegram.telegram_models import ShortMessage
+from bot.telegram_messenger import TelegramMessenger, ProcessingError, TransientProcessingError, \
+    is_media_error
+
+REPLY = ShortMessage.parse_obj({"message_id": 1, "chat": {"id": 1, "type": "private"}})
+
+
+class FakeClient:
+    """
+    Records sent media per chat, chats listed in transient fail with a transient error.
+    With reject_urls media passed by url is rejected the way telegram does it,
+    uploads are recorded with "+upload".
+    """
+    def __init__(self, transient: List[str] | None = None, reject_urls: bool = False):
+        self.transient = transient or []
+        self.reject_urls = reject_urls
+        self.sent: List[tuple] = []
+
+    def check(self, method: str, chat_id: str, uploaded: bool | None = None):
+        if chat_id in self.transient:
+            raise TelegramClientTransientError(f"{method} failed")
+        if self.reject_urls and uploaded is False:
+            raise TelegramClientBadRequest(
+                'Bad request 400 {"ok":false,"error_code":400,'
+                '"description":"Bad Request: wrong type of the web page content"}')
+        self.sent.append((method + "+upload" if uploaded else method, chat_id))
+
+    async def send_message(self, chat_id, text):
+        self.check("text", chat_id)
+
+    async def send_media_group(self, chat_id, media, files=None):
+        self.check("group", chat_id, uploaded=bool(files))
+
+    async def send_video(self, chat_id, caption, video_url=None, video_bytes=None):
+        self.check("video", chat_id, uploaded=bool(video_bytes))
+        return REPLY
+
+    async def send_photo(self, chat_id, caption, photo_url=None, photo_bytes=None):
+        self.check("photo", chat_id, uploaded=bool(photo_bytes))
+        return REPLY
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        self.check("copy", chat_id)
+
+
+class FakeProcessor:
+    """
+    Images with urls listed in broken can't be processed
+    """
+    def __init__(self, broken: List[str] | None = None):
+        self.broken = broken or []
+
+    async def photo(self, url: str) -> bytes:
+        if url in self.broken:
+            raise MediaProcessingError(f"Could not download {url}")
+        return b"jpeg"
+
+
+def post(images: int, videos: int) -> Post:
+    return Post(source_id="reddit@pics#hot#", text="title", url="https://example.com/post",
+                images=[MediaItem(urls=[f"https://example.com/{i}.jpg"])
+                        for i in range(images)] or None,
+                videos=[MediaItem(urls=["https://example.com/video.mp4"])] if videos else None)
+
+
+def failing_video(error: Exception):
+    @contextlib.asynccontextmanager
+    async def prepare_video(media_item):
+        raise error
+        yield None, None
+    return prepare_video
+
+
+@pytest.mark.asyncio
+async def test_transient_processing_error_retries_only_video():
+    messenger = TelegramMessenger("123:TOKEN")
+    messenger.tg_client = FakeClient()
+    messenger.prepare_video = failing_video(TransientProcessingError("download failed"))
+    message = OutboundMessage(conversation_ids=["1", "2"], post=post(images=2, videos=1), text=None)
+
+    retries = await messenger.process_message(message)
+    assert messenger.tg_client.sent == [("group", "1"), ("group", "2")]
+    assert len(retries) == 1
+    assert retries[0].conversation_ids == ["1", "2"]
+    assert retries[0].attempt == 1
+    # the media group was delivered already
+    assert retries[0].post.images is None
+    assert retries[0].post.videos
+
+
+@pytest.mark.asyncio
+async def test_permanent_processing_error_dropped():
+    messenger = TelegramMessenger("123:TOKEN")
+    messenger.tg_client = FakeClient()
+    messenger.prepare_video = failing_video(ProcessingError("no suitable video"))
+    message = OutboundMessage(conversation_ids=["1", "2"], post=post(images=0, videos=1), text=None)
+
+    assert await messenger.process_message(message) == []
+
+
+@pytest.mark.asyncio
+async def test_retries_split_by_step():
+    messenger = TelegramMessenger("123:TOKEN")
+    messenger.tg_client = FakeClient(transient=["2"])
+    message = OutboundMessage(conversation_ids=["1", "2", "3"], post=post(images=1, videos=0),
+                              text="hello")
+
+    retries = await messenger.process_message(message)
+    assert ("photo", "1") in messenger.tg_client.sent and ("copy", "3") in messenger.tg_client.sent
+    assert [(retry.conversation_ids, retry.text, bool(retry.post)) for retry in retries] == \
+           [(["2"], "hello", False), (["2"], None, True)]
+
+
+def test_is_media_error():
+    def bad_request(description: str) -> TelegramClientBadRequest:
+        return TelegramClientBadRequest(f"Bad request 400 Bad Request: {description}")
+
+    assert is_media_error(bad_request("failed to get HTTP URL content"))
+    assert is_media_error(bad_request("PHOTO_INVALID_DIMENSIONS"))
+    assert not is_media_error(bad_request("MEDIA_CAPTION_TOO_LONG"))
+    assert not is_media_error(bad_request("chat not found"))
+
+
+@pytest.mark.asyncio
+async def test_rejected_photo_uploaded_processed():
+    messenger = TelegramMessenger("123:TOKEN", media_processor=FakeProcessor())
+    messenger.tg_client = FakeClient(reject_urls=True)
+    message = OutboundMessage(conversation_ids=["1", "2"], post=post(images=1, videos=0), text=None)
+
+    assert await messenger.process_message(message) == []
+    assert messenger.tg_client.sent == [("photo+upload", "1"), ("copy", "2")]
+
+
+@pytest.mark.asyncio
+async def test_rejected_media_group_uploaded_processed():
+    processor = FakeProcessor(broken=["https://example.com/2.jpg"])
+    messenger = TelegramMessenger("123:TOKEN", media_processor=processor)
+    messenger.tg_client = FakeClient(reject_urls=True)
+    message = OutboundMessage(conversation_ids=["1", "2"], post=post(images=3, videos=0), text=None)
+
+    assert await messenger.process_message(message) == []
+    assert messenger.tg_client.sent == [("group+upload", "1"), ("group+upload", "2")]
+
+
+@pytest.mark.asyncio
+async def test_single_processed_image_sent_as_photo():
+    processor = FakeProcessor(broken=["https://example.com/1.jpg"])
+    messenger = TelegramMessenger("123:TOKEN", media_processor=processor)
+    messenger.tg_client = FakeClient(reject_urls=True)
+    message = OutboundMessage(conversation_ids=["1", "2"], post=post(images=2, videos=0), text=None)
+
+    assert await messenger.process_message(message) == []
+    assert messenger.tg_client.sent == [("photo+upload", "1"), ("photo+upload", "2")]
+
+
+@pytest.mark.asyncio
+async def test_unprocessed_media_group_retried():
+    messenger = TelegramMessenger("123:TOKEN", media_processor=FakeProcessor(
+        broken=["https://example.com/0.jpg", "https://example.com/1.jpg"]))
+    messenger.tg_client = FakeClient(reject_urls=True)
+    message = OutboundMessage(conversation_ids=["1", "2"], post=post(images=2, videos=0), text=None)
+
+    retries = await messenger.process_message(message)
+    assert messenger.tg_client.sent == []
+    assert [retry.conversation_ids for retry in retries] == [["1", "2"]]
@@ -22,8 +22,12 @@ def test_post_with_image_gallery():
     assert len(post.images) == 4
     assert post.videos is None
     media_item = post.images[0]
-    assert len(media_item.urls) == 1
-    assert media_item.urls[0] == "https://preview.redd.it/t6332hcll5b91.jpg?width=2799&format=pjpg&auto=webp&s=f2e3bc697305c5e0d9776c5eb0f61bdaf486b7e6"
+    assert len(media_item.urls) == 7
+    assert media_item.urls[-1] == "https://preview.redd.it/t6332hcll5b91.jpg" \
+                                  "?width=2799&format=pjpg&auto=webp" \
+                                  "&s=f2e3bc697305c5e0d9776c5eb0f61bdaf486b7e6"
+    assert media_item.sizes[-1].width == 2799
+    assert media_item.sizes[0].width == 108
 
 
 def test_post_with_image_gallery_captions():
@@ -35,8 +39,10 @@ def test_post_with_image_gallery_captions():
     assert post.url == "https://www.reddit.com/gallery/w6yf1u"
 
     assert len(post.images) == 20
-    assert len(post.images[0].urls) == 1
-    assert post.images[0].urls[0] == "https://preview.redd.it/fom6dfijajd91.jpg?width=1920&format=pjpg&auto=webp&s=028dddec12e0e3c0a4ff3325861276f7be412d46"
+    assert len(post.images[0].urls) == 7
+    assert post.images[0].urls[-1] == "https://preview.redd.it/fom6dfijajd91.jpg" \
+                                      "?width=1920&format=pjpg&auto=webp" \
+                                      "&s=028dddec12e0e3c0a4ff3325861276f7be412d46"
     assert post.images[0].caption == "At a school for gifted children, in Pyongsong, we were shown an exhibition on taxidermy. The only part of the trip where we could not help but laugh. "
 
 
@@ -49,8 +55,11 @@ def test_post_single_image_preview():
     assert post.url == "https://i.redd.it/lszwdbllwia91.jpg"
     assert len(post.images) == 1
     assert post.videos is None
-    assert len(post.images[0].urls) == 1
-    assert post.images[0].urls[0] == "https://preview.redd.it/lszwdbllwia91.jpg?auto=webp&s=60e553dc2a8e396b3ed372676d5cb205b90252f1"
+    assert len(post.images[0].urls) == 5
+    assert post.images[0].urls[-1] == "https://preview.redd.it/lszwdbllwia91.jpg" \
+                                      "?auto=webp&s=60e553dc2a8e396b3ed372676d5cb205b90252f1"
+    assert [(size.width, size.height) for size in post.images[0].sizes] == \
+           [(108, 144), (216, 288), (320, 426), (640, 853), (750, 1000)]
 
 
 def test_post_preview_gif():
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from bot.common.pubsub import Pubsub
+from bot.common.redis import get_new_redis
+from bot.common.retry import RetryScheduler, RETRY_KEY, DEAD_LETTER_KEY
+
+
+class FakeRedis:
+    """
+    Sorted set commands used by the scheduler
+    """
+    def __init__(self):
+        self.items = {}
+
+    async def zadd(self, key, mapping):
+        self.items.update(mapping)
+
+    async def zrangebyscore(self, key, low, high, start, num):
+        return sorted((item for item, score in self.items.items() if low <= score <= high),
+                      key=self.items.get)[start:start + num]
+
+    async def zrem(self, key, item):
+        return self.items.pop(item, None) is not None
+
+
+class FailingPubsub(Pubsub):
+    def __init__(self):
+        self.published = []
+        self.fail = True
+
+    async def publish(self, channel_id: str, message: str | bytes) -> None:
+        if self.fail:
+            raise ConnectionError("rabbitmq is down")
+        self.published.append((channel_id, message))
+
+
+def test_retry_delays():
+    scheduler = RetryScheduler(None, Pubsub(), delays=[1, 10, 100], max_attempts=5)
+    assert scheduler.get_delay(1) == 1
+    assert scheduler.get_delay(3) == 100
+    assert scheduler.get_delay(4) == 100
+
+
+@pytest.mark.asyncio
+async def test_retry_and_dead_letter():
+    redis = get_new_redis()
+    await redis.delete(RETRY_KEY, DEAD_LETTER_KEY)
+    scheduler = RetryScheduler(redis, Pubsub(), delays=[0], max_attempts=2)
+
+    assert await scheduler.retry("telegram_1", "msg", 1)
+    assert await scheduler.pop_due() == [("telegram_1", "msg")]
+    assert await scheduler.pop_due() == []
+
+    assert not await scheduler.retry("telegram_1", "msg", 2, reason="boom")
+    dead = json.loads(await redis.lpop(DEAD_LETTER_KEY))
+    assert dead["channel"] == "telegram_1"
+    assert dead["reason"] == "boom"
+
+
+@pytest.mark.asyncio
+async def test_failed_redelivery_rescheduled():
+    pubsub = FailingPubsub()
+    scheduler = RetryScheduler(FakeRedis(), pubsub, delays=[0], max_attempts=2)
+    assert await scheduler.retry("telegram_1", "msg", 1)
+
+    await scheduler.redeliver()
+    assert pubsub.published == []
+    pubsub.fail = False
+    await scheduler.redeliver()
+    assert pubsub.published == [("telegram_1", "msg")]
+    assert await scheduler.pop_due() == []
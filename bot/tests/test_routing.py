@@ -0,0 +1,90 @@
+import pytest
+
+from bot.common.models import SubscriptionChange
+from bot.common.routing import RoutingTable
+
+
+def change(version: int, action: str, conversation: str = "telegram_1@100") -> SubscriptionChange:
+    return SubscriptionChange(version=version, action=action, media_source="reddit@pics#top#",
+                              conversation=conversation)
+
+
+def test_apply_changes():
+    table = RoutingTable(None, None)
+
+    assert table.apply(change(1, "add"))
+    assert table.apply(change(2, "add", "telegram_1@200"))
+    assert table.apply(change(3, "add", "telegram_2@300"))
+
+    subs = table.find_subs("reddit@pics#top#")
+    assert sorted(subs["telegram_1"]) == ["100", "200"]
+    assert subs["telegram_2"] == ["300"]
+    assert table.get_sources() == ["reddit@pics#top#"]
+
+    assert table.apply(change(4, "rm"))
+    assert table.apply(change(5, "rm", "telegram_1@200"))
+    assert table.apply(change(6, "rm", "telegram_2@300"))
+    assert table.find_subs("reddit@pics#top#") == {}
+    assert table.get_sources() == []
+
+
+def test_apply_skips_old_and_detects_gaps():
+    table = RoutingTable(None, None)
+    assert table.apply(change(1, "add"))
+    assert table.apply(change(1, "rm"))
+    assert table.find_subs("reddit@pics#top#") == {"telegram_1": ["100"]}
+
+    assert not table.apply(change(3, "rm"))
+    assert table.version == 1
+
+
+def test_new_source_callback():
+    new_sources = []
+    table = RoutingTable(None, None, on_new_source=new_sources.append)
+
+    table.apply(change(1, "add"))
+    table.apply(change(2, "add", "telegram_1@200"))
+    assert new_sources == ["reddit@pics#top#"]
+
+
+class FakeConfiguration:
+    def __init__(self, subscriptions):
+        self.subscriptions = subscriptions
+
+    async def get_subscriptions(self):
+        return self.subscriptions
+
+
+class FakeRedis:
+    async def get(self, key):
+        return b"2"
+
+
+@pytest.mark.asyncio
+async def test_resync_repairs_changes_applied_out_of_order():
+    table = RoutingTable(FakeConfiguration([]), FakeRedis())
+    await table.load()
+    assert not await table._load(only_changed=True)
+
+    # rm committed after add on another replica but numbered first,
+    # the versions match while routes differ
+    table.apply(change(3, "rm"))
+    table.apply(change(4, "add"))
+    table.version = 2
+    assert table.find_subs("reddit@pics#top#") == {"telegram_1": ["100"]}
+
+    assert await table._load(only_changed=True)
+    assert table.find_subs("reddit@pics#top#") == {}
+
+
+@pytest.mark.asyncio
+async def test_reload_change():
+    configuration = FakeConfiguration([])
+    table = RoutingTable(configuration, FakeRedis())
+    await table.load()
+
+    # a restore writes subscriptions to the database directly
+    configuration.subscriptions = [("reddit@pics#top#", "telegram_1@100")]
+    await table.on_change(SubscriptionChange(version=3, action="reload", media_source="",
+                                             conversation=""))
+    assert table.find_subs("reddit@pics#top#") == {"telegram_1": ["100"]}
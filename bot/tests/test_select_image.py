@@ -0,0 +1,27 @@
+from bot.common.models import MediaItem, MediaSize
+from bot.common.settings import get_settings
+from bot.telegram_messenger import select_image_url
+
+
+def image(*sizes) -> MediaItem:
+    return MediaItem(urls=[f"{w}x{h}" for w, h in sizes],
+                     sizes=[MediaSize(width=w, height=h) for w, h in sizes])
+
+
+def test_without_sizes():
+    assert select_image_url(MediaItem(urls=["small", "original"])) == "original"
+
+
+def test_selects_largest_fitting(monkeypatch):
+    monkeypatch.setattr(get_settings(), "max_image_pixels", 2000 * 2000)
+    assert select_image_url(image((108, 80), (1080, 800), (1920, 1080))) == "1920x1080"
+    assert select_image_url(image((108, 80), (1080, 800), (4000, 3000))) == "1080x800"
+    assert select_image_url(image((1080, 800), (3000, 3000))) == "1080x800"
+
+
+def test_telegram_limits(monkeypatch):
+    monkeypatch.setattr(get_settings(), "max_image_pixels", 10 ** 9)
+    # too long panorama and too big sides
+    assert select_image_url(image((100, 1000), (210, 5000))) == "100x1000"
+    assert select_image_url(image((5000, 4000), (6000, 5000))) == "5000x4000"
+    assert select_image_url(image((50, 2000), (60, 6000))) == "50x2000"
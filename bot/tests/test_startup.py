@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from bot.common import pubsub
+from bot.common.settings import get_settings
+from bot import startup
+
+
+@pytest.mark.asyncio
+async def test_rabbit_connection_retried(monkeypatch):
+    attempts = []
+
+    async def connect_robust(url):
+        attempts.append(url)
+        if len(attempts) == 1:
+            raise ConnectionError("down")
+        return "connection"
+
+    monkeypatch.setattr(pubsub.aio_pika, "connect_robust", connect_robust)
+    with pytest.raises(ConnectionError):
+        await pubsub.get_rabbit_connection()
+    # the connection is opened once and shared
+    assert await asyncio.gather(pubsub.get_rabbit_connection(), pubsub.get_rabbit_connection()) == \
+           ["connection", "connection"]
+    assert len(attempts) == 2
+
+
+def test_run_service(monkeypatch):
+    ran = []
+
+    async def main():
+        ran.append(asyncio.get_running_loop())
+
+    monkeypatch.setenv("STARTUP_TIME", "0")
+    monkeypatch.setattr(get_settings(), "uvloop", True)
+    try:
+        startup.run_service(main, ())
+        assert len(ran) == 1
+    finally:
+        asyncio.set_event_loop_policy(None)
@@ -0,0 +1,45 @@
+import pytest
+from aiohttp import web
+
+from bot.common.settings import get_settings
+from bot.telegram.updates import TelegramUpdates
+
+PORT = 8094
+
+
+def update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": 1, "type": "private"},
+                    "text": "/list"}
+    }
+
+
+@pytest.mark.asyncio
+async def test_iter_update_batches(monkeypatch):
+    requests = []
+
+    async def get_updates(request: web.Request):
+        requests.append(await request.json())
+        first = 10 * len(requests)
+        return web.json_response({"ok": True, "result": [update(first), update(first + 1)]})
+
+    app = web.Application()
+    app.router.add_post("/bot123:TOKEN/getUpdates", get_updates)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    monkeypatch.setattr(get_settings(), "BOT_URL", f"http://127.0.0.1:{PORT}/bot")
+    try:
+        batches = TelegramUpdates("123:TOKEN").iter_update_batches()
+        first = await batches.__anext__()
+        second = await batches.__anext__()
+        await batches.aclose()
+    finally:
+        await runner.cleanup()
+
+    assert [u.update_id for u in first] == [10, 11]
+    assert [u.update_id for u in second] == [20, 21]
+    assert "offset" not in requests[0]
+    assert requests[0]["allowed_updates"] == ["message", "channel_post"]
+    assert requests[1]["offset"] == 12
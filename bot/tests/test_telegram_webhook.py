@@ -0,0 +1,119 @@
+import asyncio
+from typing import List
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from bot.common.settings import get_settings
+from bot.telegram.client import TelegramClient
+from bot.telegram.telegram_models import ShortUpdate
+from bot.telegram.webhook import TelegramWebhook, SECRET_HEADER
+from bot.telegram_reader import set_webhook
+
+PORT = 8093
+
+
+def update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": 1, "type": "private"},
+                    "text": "/list"}
+    }
+
+
+@pytest.mark.asyncio
+async def test_webhook_batches_updates():
+    batches: List[List[ShortUpdate]] = []
+
+    async def on_updates(updates: List[ShortUpdate]):
+        batches.append(updates)
+
+    webhook = TelegramWebhook(on_updates, secret_token="secret", batch_size=3, flush_interval=0.05)
+    await webhook.start("127.0.0.1", PORT)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def post(update_id: int, secret: str = "secret") -> int:
+                async with session.post(f"http://127.0.0.1:{PORT}/webhook", json=update(update_id),
+                                        headers={SECRET_HEADER: secret}) as resp:
+                    return resp.status
+
+            statuses = await asyncio.gather(*(post(i) for i in range(4)))
+            assert statuses == [200] * 4
+            assert await post(5, secret="wrong") == 403
+    finally:
+        await webhook.stop()
+
+    assert [len(batch) for batch in batches] == [3, 1]
+    assert sorted(u.update_id for batch in batches for u in batch) == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_webhook_fails_unprocessed_updates():
+    async def on_updates(updates: List[ShortUpdate]):
+        raise RuntimeError("broker is down")
+
+    webhook = TelegramWebhook(on_updates, secret_token="secret", flush_interval=0)
+    await webhook.start("127.0.0.1", PORT)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"http://127.0.0.1:{PORT}/webhook", json=update(1),
+                                    headers={SECRET_HEADER: "secret"}) as resp:
+                assert resp.status == 500
+            async with session.post(f"http://127.0.0.1:{PORT}/webhook", json=update(2)) as resp:
+                assert resp.status == 403
+    finally:
+        await webhook.stop()
+
+
+@pytest.mark.asyncio
+async def test_flush_skips_disconnected_requests():
+    async def on_updates(updates: List[ShortUpdate]):
+        pass
+
+    webhook = TelegramWebhook(on_updates, secret_token="secret")
+    loop = asyncio.get_running_loop()
+    disconnected, waiting = loop.create_future(), loop.create_future()
+    disconnected.cancel()
+    webhook.pending = [(ShortUpdate.parse_obj(update(1)), disconnected),
+                       (ShortUpdate.parse_obj(update(2)), waiting)]
+    await webhook.flush()
+    assert waiting.done() and waiting.result() is None
+
+
+@pytest.mark.asyncio
+async def test_set_webhook(monkeypatch):
+    requests = []
+
+    async def set_webhook(request: web.Request):
+        requests.append(await request.json())
+        return web.json_response({"ok": True, "result": True})
+
+    app = web.Application()
+    app.router.add_post("/bot123:TOKEN/setWebhook", set_webhook)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    monkeypatch.setattr(get_settings(), "BOT_URL", f"http://127.0.0.1:{PORT}/bot")
+    try:
+        async with aiohttp.ClientSession() as session:
+            client = TelegramClient("123:TOKEN", session)
+            assert await client.set_webhook("https://example.com/webhook/123",
+                                            secret_token="secret")
+    finally:
+        await runner.cleanup()
+
+    assert requests == [{"url": "https://example.com/webhook/123", "secret_token": "secret"}]
+
+
+@pytest.mark.asyncio
+async def test_webhook_requires_secret(monkeypatch):
+    async def on_updates(updates: List[ShortUpdate]):
+        pass
+
+    with pytest.raises(ValueError):
+        TelegramWebhook(on_updates, secret_token="")
+
+    monkeypatch.setattr(get_settings(), "webhook_secret", "")
+    with pytest.raises(ValueError):
+        await set_webhook("123:TOKEN")
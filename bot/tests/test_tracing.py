@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from pydantic import parse_raw_as
+
+from bot.common.models import Post, OutboundMessage
+from bot.common.settings import get_settings
+from bot.common.tracing import start_trace, mark_routed, mark_media_ready, mark_delivered, \
+    get_span_exporter
+
+
+@pytest.mark.asyncio
+async def test_trace_propagation(monkeypatch, tmp_path):
+    trace_file = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(get_settings(), "trace_file", str(trace_file))
+    get_span_exporter.cache_clear()
+    try:
+        post = Post(source_id="reddit@pics", text="text", url="url")
+        start_trace(post, time.time() - 60)
+        # the scrapper publishes only set fields
+        post = parse_raw_as(Post, post.json(exclude_unset=True, exclude_defaults=True,
+                                            exclude_none=True))
+        assert post.trace.created and post.trace.scraped
+
+        mark_routed(post)
+        message = OutboundMessage(conversation_ids=["1"], post=post)
+        message = parse_raw_as(OutboundMessage, message.json())
+        mark_media_ready(message.post)
+        media_ready = message.post.trace.media_ready
+        mark_media_ready(message.post)
+        assert message.post.trace.media_ready == media_ready
+        mark_delivered(message.post, "1")
+
+        get_span_exporter().close()
+    finally:
+        get_span_exporter.cache_clear()
+
+    spans = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert [span["name"] for span in spans] == ["scrape", "route", "media", "deliver", "total"]
+    assert {span["traceId"] for span in spans} == {post.trace.trace_id}
+    assert spans[0]["endTimeUnixNano"] - spans[0]["startTimeUnixNano"] >= 60 * 10 ** 9
+    assert spans[-1]["attributes"] == {"source_id": "reddit@pics", "chat_id": "1"}
+
+
+def test_spans_written_at_exit(tmp_path):
+    trace_file = tmp_path / "spans.jsonl"
+    script = "import asyncio, time\n" \
+             "from bot.common.models import Post\n" \
+             "from bot.common.tracing import start_trace\n" \
+             "async def main():\n" \
+             "    post = Post(source_id='reddit@pics', text='text', url='url')\n" \
+             "    start_trace(post, time.time())\n" \
+             "asyncio.run(main())\n"
+    result = subprocess.run([sys.executable, "-c", script],
+                            env={**os.environ, "TRACE_FILE": str(trace_file)},
+                            capture_output=True, text=True)
+    assert result.returncode == 0
+    assert not result.stderr
+    assert [json.loads(line)["name"] for line in trace_file.read_text().splitlines()] == ["scrape"]
+
+
+def test_untraced_post():
+    post = Post(source_id="reddit@pics", text="text", url="url")
+    mark_routed(post)
+    mark_delivered(post, "1")
+    assert post.trace is None
@@ -0,0 +1,85 @@
+import argparse
+import time
+
+import pytest
+
+from bot import traffic
+from bot.common.pubsub import Pubsub, PubsubRabbitmq
+from bot.traffic import write_records, read_records, replay
+
+
+class ListPubsub(Pubsub):
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, channel_id: str, message: str | bytes) -> None:
+        self.published.append((time.monotonic(), channel_id, message))
+
+
+class FakeExchange:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, routing_key, mandatory=True):
+        self.published.append((routing_key, mandatory))
+
+
+class FakeConnection:
+    async def ready(self):
+        pass
+
+
+def test_log_roundtrip(tmp_path):
+    filename = str(tmp_path / "traffic.jsonl.gz")
+    write_records(filename, [(1.0, "media", "{}")])
+    write_records(filename, [(2.0, "telegram_1", '{"a": 1}')])
+    assert list(read_records(filename)) == [(1.0, "media", "{}"), (2.0, "telegram_1", '{"a": 1}')]
+
+
+def test_truncated_log(tmp_path):
+    filename = tmp_path / "traffic.jsonl.gz"
+    write_records(str(filename), [(1.0, "media", "{}")])
+    write_records(str(filename), [(float(i), "media", "x" * 100) for i in range(100)])
+    # an interrupted write leaves a partial gzip member at the end
+    filename.write_bytes(filename.read_bytes()[:-10])
+    assert list(read_records(str(filename)))[0] == (1.0, "media", "{}")
+
+
+@pytest.mark.asyncio
+async def test_replay_speed():
+    records = [(100.0, "media", "1"), (100.5, "incoming_message", "2"), (101.0, "telegram_1", "3"),
+               (101.0, "other", "4")]
+    pubsub = ListPubsub()
+    channels = ["media", "incoming_message", "telegram_*"]
+    assert await replay(pubsub, iter(records), channels, speed=10) == 3
+    assert [body for _, __, body in pubsub.published] == ["1", "2", "3"]
+    elapsed = pubsub.published[-1][0] - pubsub.published[0][0]
+    assert 0.09 <= elapsed < 0.5
+
+    pubsub = ListPubsub()
+    await replay(pubsub, iter(records), ["*"], speed=0)
+    assert len(pubsub.published) == 4
+    assert pubsub.published[-1][0] - pubsub.published[0][0] < 0.05
+
+
+@pytest.mark.asyncio
+async def test_tap_copies_not_mandatory():
+    pubsub = PubsubRabbitmq()
+    pubsub.connection = FakeConnection()
+    exchange, pubsub.tap = FakeExchange(), FakeExchange()
+    pubsub.channel = type("Channel", (), {"default_exchange": exchange})()
+
+    await pubsub.publish("media", "1")
+    await pubsub.publish_many("media", ["2", "3"])
+    assert exchange.published == [("media", True)] * 3
+    # no recorder bound to the tap is not an error
+    assert pubsub.tap.published == [("media", False)] * 3
+
+
+@pytest.mark.asyncio
+async def test_record_needs_tap(monkeypatch, tmp_path):
+    monkeypatch.setattr(traffic, "get_new_pubsub", ListPubsub)
+    args = argparse.Namespace(command="record", file=str(tmp_path / "traffic.jsonl.gz"),
+                              channels=["*"])
+    with pytest.raises(SystemExit, match="ListPubsub"):
+        await traffic.main(args)
@@ -0,0 +1,117 @@
+"""
+Records pipeline traffic to a gzipped JSONL log and replays it, e.g. into a test deployment.
+Recording needs pubsub_tap enabled in the services,
+every line is {"t": publish time, "channel": ..., "body": ...}.
+
+python -m bot.traffic record traffic.jsonl.gz
+python -m bot.traffic replay traffic.jsonl.gz --speed 10
+"""
+import argparse
+import asyncio
+import fnmatch
+import gzip
+import json
+import sys
+import time
+from typing import List, Iterator, Tuple
+
+from bot.common.pubsub import Pubsub, PubsubRabbitmq, get_new_pubsub
+
+DEFAULT_CHANNELS = ["media", "incoming_message", "telegram_*"]
+
+
+def matches(channel: str, patterns: List[str]) -> bool:
+    return any(fnmatch.fnmatchcase(channel, pattern) for pattern in patterns)
+
+
+def write_records(filename: str, records: List[Tuple[float, str, str]]):
+    # every batch is a separate gzip member, the log stays readable after an interrupted write
+    with gzip.open(filename, "at") as f:
+        f.writelines(json.dumps({"t": t, "channel": channel, "body": body}) + "\n"
+                     for t, channel, body in records)
+
+
+def read_records(filename: str) -> Iterator[Tuple[float, str, str]]:
+    with gzip.open(filename, "rt") as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # partially written last line
+                    continue
+                yield record["t"], record["channel"], record["body"]
+        except (EOFError, gzip.BadGzipFile):
+            # the last gzip member was cut short, records before it are complete
+            print(f"{filename} is truncated, stopped at the last complete batch", file=sys.stderr)
+
+
+async def record(pubsub: PubsubRabbitmq, filename: str, channels: List[str],
+                 flush_interval: float = 1.0):
+    records: List[Tuple[float, str, str]] = []
+    last_flush = time.monotonic()
+    try:
+        async for channel, published_at, body in pubsub.stream_tap():
+            if not matches(channel, channels):
+                continue
+            records.append((published_at, channel, body.decode()))
+            if time.monotonic() - last_flush >= flush_interval:
+                batch, records = records, []
+                last_flush = time.monotonic()
+                await asyncio.to_thread(write_records, filename, batch)
+                print(f"Recorded {len(batch)} messages", file=sys.stderr)
+    finally:
+        if records:
+            write_records(filename, records)
+
+
+async def replay(pubsub: Pubsub, records: Iterator[Tuple[float, str, str]], channels: List[str],
+                 speed: float) -> int:
+    """
+    Publishes records keeping their relative timing divided by speed,
+    speed 0 replays as fast as possible
+    """
+    loop = asyncio.get_running_loop()
+    first: float | None = None
+    started = loop.time()
+    count = 0
+    for t, channel, body in records:
+        if not matches(channel, channels):
+            continue
+        if first is None:
+            first = t
+        if speed:
+            delay = started + (t - first) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await pubsub.publish(channel, body)
+        count += 1
+    return count
+
+
+async def main(args):
+    pubsub = get_new_pubsub()
+    if args.command == "record":
+        if not isinstance(pubsub, PubsubRabbitmq):
+            # only the rabbitmq tap exchange keeps copies of published messages
+            sys.exit(f"Recording is not supported by {type(pubsub).__name__}")
+        await record(pubsub, args.file, args.channels)
+    else:
+        count = await replay(pubsub, read_records(args.file), args.channels, args.speed)
+        print(f"Replayed {count} messages", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record and replay pubsub traffic")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="append tapped messages to the log")
+    record_parser.add_argument("file")
+    record_parser.add_argument("--channels", nargs="+", default=DEFAULT_CHANNELS,
+                               help="channel patterns")
+    replay_parser = subparsers.add_parser("replay", help="publish messages from the log")
+    replay_parser.add_argument("file")
+    replay_parser.add_argument("--channels", nargs="+", default=DEFAULT_CHANNELS,
+                               help="channel patterns")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="time scale, 0 is as fast as possible")
+    asyncio.run(main(parser.parse_args()))
@@ -1,5 +1,9 @@
 #!/bin/bash
 export PYTHONUNBUFFERED=1
+# setuptools replaces distutils with its own copy, importing it through aioredis costs ~250ms per process
+export SETUPTOOLS_USE_DISTUTILS=stdlib
+# services report their startup time relative to this
+export STARTUP_TIME=$(date +%s.%N)
 
 echo $1
 
@@ -9,7 +13,14 @@ if [ "$1" = "bot.bot" ] || [ "$1" = "tests" ] ; then
     sleep 1
   done
 fi
-python -m bot.startup
+case "$1" in
+  bot.bot|bot.telegram_reader|bot.telegram_messenger|bot.reddit_scrapper)
+    # services wait for their own dependencies in-process and keep the connections
+    ;;
+  *)
+    python -m bot.startup
+    ;;
+esac
 if [ "$1" = "tests" ] ; then
   python -m pytest -s
 else